@@ -13,7 +13,7 @@ from pathlib import Path
 sys.path.append(str(Path(__file__).parent.parent))
 
 from app.database import Base
-from app.models import feedback  # モデルをインポート
+from app.models import feedback, api_key  # モデルをインポート
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
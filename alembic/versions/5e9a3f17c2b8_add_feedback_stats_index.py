@@ -0,0 +1,32 @@
+"""Add composite index for feedback stats aggregation
+
+Revision ID: 5e9a3f17c2b8
+Revises: d27e9a4c1f63
+Create Date: 2026-10-15 13:05:22.481930
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e9a3f17c2b8'
+down_revision: Union[str, None] = 'd27e9a4c1f63'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # /api/v2/feedback/stats のモデル別・期間指定の集計用
+    op.create_index(
+        'ix_feedbacks_model_name_created_at',
+        'feedbacks',
+        ['model_name', 'created_at'],
+        unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_feedbacks_model_name_created_at', table_name='feedbacks')
@@ -0,0 +1,34 @@
+"""Use (api_key_id, date) as the primary key of api_usage
+
+Revision ID: 8c41f0d2b7a5
+Revises: f5120bd53e3a
+Create Date: 2026-10-15 10:02:17.584302
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8c41f0d2b7a5'
+down_revision: Union[str, None] = 'f5120bd53e3a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.drop_constraint('_api_key_date_uc', 'api_usage', type_='unique')
+    op.drop_index('ix_api_usage_id', table_name='api_usage')
+    op.drop_constraint('api_usage_pkey', 'api_usage', type_='primary')
+    op.drop_column('api_usage', 'id')
+    op.create_primary_key('api_usage_pkey', 'api_usage', ['api_key_id', 'date'])
+
+
+def downgrade() -> None:
+    op.drop_constraint('api_usage_pkey', 'api_usage', type_='primary')
+    op.add_column('api_usage', sa.Column('id', sa.Integer(), sa.Identity(), nullable=False))
+    op.create_primary_key('api_usage_pkey', 'api_usage', ['id'])
+    op.create_index('ix_api_usage_id', 'api_usage', ['id'], unique=False)
+    op.create_unique_constraint('_api_key_date_uc', 'api_usage', ['api_key_id', 'date'])
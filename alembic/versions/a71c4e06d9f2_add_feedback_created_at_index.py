@@ -0,0 +1,27 @@
+"""Add created_at index for recent feedback listing
+
+Revision ID: a71c4e06d9f2
+Revises: 5e9a3f17c2b8
+Create Date: 2026-10-15 13:41:07.219553
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a71c4e06d9f2'
+down_revision: Union[str, None] = '5e9a3f17c2b8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # /api/v2/feedback/recent の ORDER BY created_at DESC LIMIT をインデックスの逆順走査で処理
+    op.create_index('ix_feedbacks_created_at', 'feedbacks', ['created_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_feedbacks_created_at', table_name='feedbacks')
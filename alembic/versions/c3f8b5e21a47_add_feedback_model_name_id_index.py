@@ -0,0 +1,38 @@
+"""Add (model_name, id DESC) index for keyset pagination of recent feedback
+
+Revision ID: c3f8b5e21a47
+Revises: a71c4e06d9f2
+Create Date: 2026-10-15 15:20:36.774012
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3f8b5e21a47'
+down_revision: Union[str, None] = 'a71c4e06d9f2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # /api/v2/feedback/recent?model_name=...&before_id=... をインデックスの範囲走査で処理
+    # （model_name指定なしの場合は主キーのインデックスを使用）
+    op.create_index(
+        'ix_feedbacks_model_name_id',
+        'feedbacks',
+        ['model_name', sa.text('id DESC')],
+        unique=False
+    )
+    
+    # /recentがIDの降順になり、created_at単独のインデックスを使う検索がなくなったため削除
+    # （統計の期間指定は ix_feedbacks_model_name_created_at を使用）
+    op.drop_index('ix_feedbacks_created_at', table_name='feedbacks')
+
+
+def downgrade() -> None:
+    op.create_index('ix_feedbacks_created_at', 'feedbacks', ['created_at'], unique=False)
+    op.drop_index('ix_feedbacks_model_name_id', table_name='feedbacks')
@@ -0,0 +1,41 @@
+"""Store API keys as SHA-256 hashes
+
+Revision ID: d27e9a4c1f63
+Revises: 8c41f0d2b7a5
+Create Date: 2026-10-15 10:48:55.916027
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd27e9a4c1f63'
+down_revision: Union[str, None] = '8c41f0d2b7a5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('api_keys', sa.Column('api_key_hash', sa.LargeBinary(length=32), nullable=True))
+    # 既存キーのハッシュを生成（PostgreSQL 11以降の組み込みsha256）
+    op.execute("UPDATE api_keys SET api_key_hash = sha256(convert_to(api_key, 'UTF8'))")
+    op.alter_column('api_keys', 'api_key_hash', nullable=False)
+    op.create_index(op.f('ix_api_keys_api_key_hash'), 'api_keys', ['api_key_hash'], unique=True)
+
+    # 検索はユニークインデックス（ix_api_keys_api_key_hash）で行うため部分インデックスは作らない
+    op.drop_index('api_keys_active_key_idx', table_name='api_keys', if_exists=True)
+
+    # 平文のキーは削除
+    op.drop_index('ix_api_keys_api_key', table_name='api_keys', if_exists=True)
+    op.drop_column('api_keys', 'api_key')
+
+
+def downgrade() -> None:
+    # 平文のキーは復元できないため、列のみ戻す
+    op.add_column('api_keys', sa.Column('api_key', sa.String(length=64), nullable=True))
+    op.create_index('ix_api_keys_api_key', 'api_keys', ['api_key'], unique=True)
+    op.drop_index(op.f('ix_api_keys_api_key_hash'), table_name='api_keys')
+    op.drop_column('api_keys', 'api_key_hash')
@@ -0,0 +1,75 @@
+"""
+Redisキャッシュ
+REDIS_URLが設定されている場合のみ有効（未設定時は全操作が何もしない）
+"""
+import os
+import logging
+from typing import Any, Optional
+import orjson
+from dotenv import load_dotenv
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+logger = logging.getLogger(__name__)
+
+# .envファイルから環境変数を読み込み
+load_dotenv()
+
+REDIS_URL = os.getenv("REDIS_URL")
+
+# Redisクライアント（接続は初回コマンド時に確立される）
+redis = aioredis.Redis.from_url(REDIS_URL) if (aioredis and REDIS_URL) else None
+
+if REDIS_URL and aioredis is None:
+    logger.warning("REDIS_URLが設定されていますが、redisパッケージがインストールされていません")
+
+
+async def get_json(key: str) -> Optional[Any]:
+    """キーに対応するJSON値を取得（ミス・障害時はNone）"""
+    if redis is None:
+        return None
+    try:
+        cached = await redis.get(key)
+    except Exception as e:
+        logger.warning(f"Redis取得エラー: {e}")
+        return None
+    return orjson.loads(cached) if cached is not None else None
+
+
+async def set_json(key: str, value: Any, ttl: int) -> None:
+    """値をJSONとしてTTL付きで保存"""
+    if redis is None:
+        return
+    try:
+        await redis.set(key, orjson.dumps(value), ex=ttl)
+    except Exception as e:
+        logger.warning(f"Redis保存エラー: {e}")
+
+
+async def delete(key: str) -> None:
+    """キーを削除"""
+    if redis is None:
+        return
+    try:
+        await redis.delete(key)
+    except Exception as e:
+        logger.warning(f"Redis削除エラー: {e}")
+
+
+async def incr(key: str, ttl: int, amount: int = 1) -> Optional[int]:
+    """カウンタをアトミックに加算して新しい値を返す（Redis未使用時はNone）"""
+    if redis is None:
+        return None
+    try:
+        pipe = redis.pipeline()
+        pipe.incr(key, amount)
+        pipe.expire(key, ttl)
+        count, _ = await pipe.execute()
+    except Exception as e:
+        logger.warning(f"Redisカウンタ更新エラー: {e}")
+        return None
+    return int(count)
+
@@ -91,7 +91,11 @@ PERFORMANCE_CONFIG = {
     "max_concurrent": 20,       # 最大同時処理数
     "error_threshold": 0.01,    # エラー率閾値（1%）
     "batch_size": 4,           # バッチ処理サイズ
-    "use_gpu": False,          # GPU使用フラグ
+    "use_gpu": os.getenv("TOXIC_BERT_USE_GPU", "false").lower() == "true",  # GPU使用フラグ（CUDAがない環境では無視）
+    # 埋め込みモデルのint8量子化（ONNX・PyTorch共通）。類似度がわずかに変わり閾値付近の判定が変わりうるため、
+    # FP32モデルと判定を比較して問題がないことを確認した環境でのみ有効にする
+    "quantize_embeddings": os.getenv("TOXIC_BERT_QUANTIZE", "false").lower() == "true",
+    "embedding_backend": os.getenv("TOXIC_BERT_BACKEND", "onnx"),  # onnx / torch（onnxruntime未導入時はtorch）
     "external_api_timeout": float(os.getenv("EXTERNAL_API_TIMEOUT", "10"))
 }
 
@@ -187,13 +191,21 @@ API_SPECIFIC_CONFIG = {
         "model": "claude-3-haiku-20240307",
         "max_tokens": 200,
         "temperature": 0,
-        "system_prompt": "あなたは日本語テキストの毒性を判定する専門家です。"
+        "system_prompt": "あなたは日本語テキストの毒性を判定する専門家です。",
+        "max_concurrency": int(os.getenv("CLAUDE_MAX_CONCURRENCY", "8")),  # API同時呼び出し数
+        "max_retries": int(os.getenv("CLAUDE_MAX_RETRIES", "3")),  # 429/5xx時の再試行回数（指数バックオフ）
+        "rate_limit": float(os.getenv("CLAUDE_RATE_LIMIT", "0")),  # 毎秒の呼び出し数の上限（0で無制限）
+        "max_input_chars": 2000  # APIへ送るテキストの上限文字数
     },
     "openai": {
         "model": "gpt-3.5-turbo",
         "max_tokens": 200,
         "temperature": 0,
-        "system_prompt": "You are an expert in detecting toxicity in Japanese text."
+        "system_prompt": "You are an expert in detecting toxicity in Japanese text.",
+        "max_retries": int(os.getenv("OPENAI_MAX_RETRIES", "3")),  # 429/5xx時の再試行回数（指数バックオフ）
+        "max_connections": int(os.getenv("OPENAI_MAX_CONNECTIONS", "64")),  # 接続プールの上限
+        "circuit_failure_threshold": 5,  # この回数連続で障害が続いたら呼び出しを停止
+        "circuit_reset_timeout": 30.0  # 停止してから試行を再開するまでの秒数
     },
     
 }
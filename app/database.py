@@ -2,8 +2,11 @@
 
 import os
 from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.orm import DeclarativeBase, sessionmaker
 from dotenv import load_dotenv
 
 # .envファイルから環境変数を読み込み
@@ -12,14 +15,83 @@ load_dotenv()
 # データベースURL（.envから読み込むか、デフォルト値を使用）
 DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://localhost/toxiguard_db")
 
-# SQLAlchemyエンジンの作成
-engine = create_engine(DATABASE_URL, echo=False)  # echo=Trueでデバッグ用SQL表示
+# SQLAlchemyエンジンの作成（同期・非同期の2つ）
+# 接続数の目安: workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW + DB_ASYNC_POOL_SIZE + DB_ASYNC_MAX_OVERFLOW)
+#   < PostgreSQLのmax_connections（既定100。既定値では1ワーカーあたり50 + 20 = 70）
+# 同期エンジンは同期エンドポイントのスレッドから使うため、スレッドプールの上限（main.pyのTHREADPOOL_SIZE）は
+# DB_POOL_SIZE + DB_MAX_OVERFLOW 以下にする（超えた分のスレッドは接続待ちでpool_timeoutまで塞がる）
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 20))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 30))
+# 非同期エンジンは認証・APIキー管理の短いクエリのみのため、同期側より小さいプールで足りる
+DB_ASYNC_POOL_SIZE = int(os.getenv("DB_ASYNC_POOL_SIZE", 10))
+DB_ASYNC_MAX_OVERFLOW = int(os.getenv("DB_ASYNC_MAX_OVERFLOW", 10))
+if DATABASE_URL.startswith("sqlite"):
+    # テスト用SQLite：単一接続を共有してプールエラーを回避
+    engine = create_engine(
+        DATABASE_URL,
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+        echo=False
+    )
+else:
+    engine = create_engine(
+        DATABASE_URL,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_pre_ping=True,   # チェックアウト前にSELECT 1で死んだ接続を検出
+        pool_recycle=1800,    # アイドルタイムアウト前に接続を作り直す
+        echo=False            # echo=Trueでデバッグ用SQL表示
+    )
 
 # セッションメーカーの作成
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+
+def _to_async_url(url: str) -> URL:
+    """同期ドライバのURLを非同期ドライバ（asyncpg/aiosqlite）のURLに変換"""
+    async_url = make_url(url)
+    backend = async_url.get_backend_name()
+    if backend == "postgresql":
+        return async_url.set(drivername="postgresql+asyncpg")
+    if backend == "sqlite":
+        return async_url.set(drivername="sqlite+aiosqlite")
+    return async_url
+
+
+# 非同期エンジン：リクエストごとにDBへアクセスする認証・APIキー管理で使用し、
+# DB待ちの間もイベントループを塞がない
+if DATABASE_URL.startswith("sqlite"):
+    async_engine = create_async_engine(
+        _to_async_url(DATABASE_URL),
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+        echo=False
+    )
+else:
+    async_engine = create_async_engine(
+        _to_async_url(DATABASE_URL),
+        pool_size=DB_ASYNC_POOL_SIZE,
+        max_overflow=DB_ASYNC_MAX_OVERFLOW,
+        pool_pre_ping=True,
+        pool_recycle=1800,
+        echo=False
+    )
+
+# 非同期セッションメーカー（コミット後も属性を再読み込みせずに参照できるようにする）
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+
+
+def upsert_insert(dialect_name: str):
+    """
+    ON CONFLICT（UPSERT）用のinsertを返す
+    PostgreSQL・SQLiteのどちらもon_conflict_do_update/excludedを同じ形で使える
+    """
+    return sqlite.insert if dialect_name == "sqlite" else postgresql.insert
+
 # ベースクラスの作成
-Base = declarative_base()
+class Base(DeclarativeBase):
+    """全モデル共通のベースクラス"""
+    pass
 
 # データベース接続を取得する関数
 def get_db():
@@ -29,6 +101,12 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    """非同期データベースセッションを提供するジェネレータ"""
+    async with AsyncSessionLocal() as db:
+        yield db
         
 # 既存のコードの最後に以下を追加
 
@@ -2,27 +2,121 @@
 APIキー認証ミドルウェア
 発行されたAPIキーでAPIアクセスを制御
 """
-from fastapi import HTTPException, Security, Depends
+from fastapi import HTTPException, Security
 from fastapi.security import APIKeyHeader
-from sqlalchemy.orm import Session
+from sqlalchemy import select, text
+from dataclasses import dataclass
 from datetime import date
 from typing import Optional
+from cachetools import TTLCache
 
-from app.database import get_db
+from app import cache
+from app.database import AsyncSessionLocal, upsert_insert
 from app.models.api_key import APIKey, APIUsage
 
 # APIキーヘッダーの定義
 api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
 
+
+
+@dataclass(slots=True)
+class APIKeyInfo:
+    """認証済みAPIキーの情報（下流で使うのはidとdaily_limitのみ）"""
+    id: int
+    daily_limit: int
+    is_active: bool = True
+
+
+# APIキーキャッシュの有効期限（秒）
+API_KEY_CACHE_TTL = 300
+
+# 使用量カウンタの保持期間（秒）：日付が変わった後の集計反映に余裕を持たせる
+USAGE_COUNTER_TTL = 172800
+
+# ワーカー内のL1キャッシュ（Redisへの往復を省略。他ワーカーでの変更はTTL経過後に反映）
+# キーはDB・Redisと同じSHA-256ダイジェスト（ミス時に別のハッシュを計算しない）
+API_KEY_LOCAL_CACHE_SIZE = 10_000
+API_KEY_LOCAL_CACHE_TTL = 30
+_key_cache = TTLCache(maxsize=API_KEY_LOCAL_CACHE_SIZE, ttl=API_KEY_LOCAL_CACHE_TTL)
+
+
+def api_key_cache_key(api_key_hash: bytes) -> str:
+    """APIキーのキャッシュキー（DBと同じハッシュを使い、平文は保存しない）"""
+    return f"apikey:{api_key_hash.hex()}"
+
+
+def usage_counter_key(api_key_id: int, day: date) -> str:
+    """日別使用量カウンタのキー（apiusage:{id}:{YYYYMMDD}）"""
+    return f"apiusage:{api_key_id}:{day:%Y%m%d}"
+
+
+async def invalidate_api_key_cache(api_key: str) -> None:
+    """
+    is_active/daily_limit変更後に呼び出してキャッシュを破棄
+    （他ワーカーのL1キャッシュは最大API_KEY_LOCAL_CACHE_TTL秒で失効）
+    """
+    api_key_hash = APIKey.hash_api_key(api_key)
+    _key_cache.pop(api_key_hash, None)
+    await cache.delete(api_key_cache_key(api_key_hash))
+
+
+async def _load_api_key(api_key_hash: bytes) -> APIKeyInfo:
+    """Redis、ミス時はデータベースから有効なAPIキーを取得（無効なら403）"""
+    cache_key = api_key_cache_key(api_key_hash)
+    record_data = await cache.get_json(cache_key)
+    
+    if record_data is None:
+        # ORMオブジェクトを生成せず必要な列だけを取得
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(APIKey.id, APIKey.daily_limit).where(
+                    APIKey.api_key_hash == api_key_hash,
+                    APIKey.is_active == True
+                )
+            )
+            row = result.first()
+        
+        if not row:
+            raise HTTPException(
+                status_code=403,
+                detail="無効なAPIキーです"
+            )
+        
+        record_data = {
+            "id": row.id,
+            "daily_limit": row.daily_limit,
+            "is_active": True
+        }
+        
+        await cache.set_json(cache_key, record_data, ttl=API_KEY_CACHE_TTL)
+    
+    return APIKeyInfo(**record_data)
+
+
+async def _persisted_usage(api_key_id: int, day: date) -> int:
+    """api_usageに反映済みの使用量（行がなければ0）"""
+    async with AsyncSessionLocal() as db:
+        count = await db.scalar(
+            select(APIUsage.request_count).where(
+                APIUsage.api_key_id == api_key_id,
+                APIUsage.date == day
+            )
+        )
+    return count or 0
+
+
 async def verify_api_key(
-    api_key: Optional[str] = Security(api_key_header),
-    db: Session = Depends(get_db)
-) -> APIKey:
+    api_key: Optional[str] = Security(api_key_header)
+) -> APIKeyInfo:
     """
     APIキーを検証し、使用量をチェック
     
+    DBセッションは検証と使用量更新の間だけ保持し、ハンドラ本体（モデル推論）の
+    実行中にはコネクションプールを占有しない。DBアクセスは非同期ドライバで行い、
+    待ち時間中もイベントループを塞がない。
+    
     Returns:
-        APIKey: 有効なAPIキーレコード
+        APIKeyInfo: 有効なAPIキーの情報
     
     Raises:
         HTTPException: 無効なキーまたは制限超過
@@ -34,57 +128,69 @@ async def verify_api_key(
             detail="APIキーが必要です。X-API-Keyヘッダーに設定してください。"
         )
     
-    # APIキーをデータベースで検索
-    api_key_record = db.query(APIKey).filter(
-        APIKey.api_key == api_key,
-        APIKey.is_active == True
-    ).first()
+    # キャッシュを優先して参照し（L1: ワーカー内 → L2: Redis）、ミス時のみデータベースで検索
+    api_key_hash = APIKey.hash_api_key(api_key)
+    api_key_record = _key_cache.get(api_key_hash)
+    if api_key_record is None:
+        api_key_record = await _load_api_key(api_key_hash)
+        _key_cache[api_key_hash] = api_key_record
     
-    if not api_key_record:
-        raise HTTPException(
-            status_code=403,
-            detail="無効なAPIキーです"
-        )
-    
-    # 今日の使用量を確認
+    # 今日の使用量をRedisで加算（DBへは定期的にまとめて反映）
     today = date.today()
-    usage = db.query(APIUsage).filter(
-        APIUsage.api_key_id == api_key_record.id,
-        APIUsage.date == today
-    ).first()
+    counter_key = usage_counter_key(api_key_record.id, today)
+    count = await cache.incr(counter_key, ttl=USAGE_COUNTER_TTL)
     
-    # 使用量レコードがない場合は作成
-    if not usage:
-        usage = APIUsage(
+    if count == 1:
+        # カウンタが新規作成された：日の初回か、Redisの再起動・退避で失われた場合は
+        # 反映済みの使用量から数え直す（0からやり直して制限がリセットされないように）
+        persisted = await _persisted_usage(api_key_record.id, today)
+        if persisted:
+            count = await cache.incr(counter_key, ttl=USAGE_COUNTER_TTL, amount=persisted)
+    
+    if count is not None:
+        if count > api_key_record.daily_limit:
+            raise HTTPException(
+                status_code=429,
+                detail=f"1日の使用制限（{api_key_record.daily_limit}回）に達しました。明日またお試しください。"
+            )
+        return api_key_record
+    
+    # Redis未使用時はデータベースで直接カウント（UPSERTで加算と取得を1往復で行う）
+    async with AsyncSessionLocal() as db:
+        dialect_name = db.bind.dialect.name
+        stmt = upsert_insert(dialect_name)(APIUsage).values(
             api_key_id=api_key_record.id,
             date=today,
-            request_count=0
-        )
-        db.add(usage)
-        db.commit()
+            request_count=1
+        ).on_conflict_do_update(
+            index_elements=["api_key_id", "date"],
+            set_={"request_count": APIUsage.__table__.c.request_count + 1}
+        ).returning(APIUsage.__table__.c.request_count)
+        
+        # 使用量は多少失われても問題ないため、このトランザクションのみWALのfsyncを待たない
+        if dialect_name == "postgresql":
+            await db.execute(text("SET LOCAL synchronous_commit = off"))
+        result = await db.execute(stmt)
+        count = result.scalar_one()
+        await db.commit()
     
-    # 使用制限をチェック
-    if usage.request_count >= api_key_record.daily_limit:
+    # 使用制限をチェック（超過分もカウントされるがRedis経路と同じ扱い）
+    if count > api_key_record.daily_limit:
         raise HTTPException(
             status_code=429,
             detail=f"1日の使用制限（{api_key_record.daily_limit}回）に達しました。明日またお試しください。"
         )
     
-    # 使用回数を増やす
-    usage.request_count += 1
-    db.commit()
-    
     return api_key_record
 
 # オプション：開発環境では認証をスキップ
 async def verify_api_key_optional(
-    api_key: Optional[str] = Security(api_key_header),
-    db: Session = Depends(get_db)
-) -> Optional[APIKey]:
+    api_key: Optional[str] = Security(api_key_header)
+) -> Optional[APIKeyInfo]:
     """
     APIキーがある場合のみ検証（開発用）
     """
     if not api_key:
         return None
     
-    return await verify_api_key(api_key, db)
\ No newline at end of file
+    return await verify_api_key(api_key)
@@ -4,9 +4,9 @@ APIキー管理モデル
 """
 from datetime import datetime
 from typing import Optional
+import hashlib
 import secrets
-import string
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Date, UniqueConstraint, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Date, ForeignKey, LargeBinary
 from sqlalchemy.orm import relationship
 from app.database import Base
 
@@ -21,8 +21,8 @@ class APIKey(Base):
     # メールアドレス（ユニークではない：同じメールで複数キー発行可能）
     email = Column(String(255), nullable=False, index=True)
     
-    # APIキー（ユニーク、64文字）
-    api_key = Column(String(64), unique=True, nullable=False, index=True)
+    # APIキーのSHA-256ハッシュ（平文は保存せず、発行時に一度だけ利用者へ返す）
+    api_key_hash = Column(LargeBinary(32), unique=True, nullable=False, index=True)
     
     # 作成日時
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -39,31 +39,28 @@ class APIKey(Base):
     @staticmethod
     def generate_api_key() -> str:
         """セキュアなAPIキーを生成"""
-        # 英数字で64文字のランダム文字列
-        alphabet = string.ascii_letters + string.digits
-        return ''.join(secrets.choice(alphabet) for _ in range(64))
+        # 48バイト（384ビット）の乱数をURLセーフなBase64で64文字に
+        return secrets.token_urlsafe(48)
+    
+    @staticmethod
+    def hash_api_key(api_key: str) -> bytes:
+        """APIキーのSHA-256ダイジェスト（DB・キャッシュ共通の検索キー）"""
+        return hashlib.sha256(api_key.encode()).digest()
 
 
 class APIUsage(Base):
     """API使用量追跡テーブル"""
     __tablename__ = "api_usage"
     
-    # 主キー
-    id = Column(Integer, primary_key=True, index=True)
-    
+    # 複合主キー（APIキー・日付）：検索・UPSERTは常にこの組み合わせで行う
     # APIキーへの外部キー
-    api_key_id = Column(Integer, ForeignKey("api_keys.id"), nullable=False)
+    api_key_id = Column(Integer, ForeignKey("api_keys.id"), primary_key=True)
     
     # 使用日（日別集計用）
-    date = Column(Date, nullable=False)
+    date = Column(Date, primary_key=True)
     
     # その日のリクエスト数
     request_count = Column(Integer, default=0)
     
     # APIキーとのリレーション
     api_key_record = relationship("APIKey", back_populates="usage_records")
-    
-    # 複合ユニーク制約（同じAPIキー・日付の組み合わせは1レコードのみ）
-    __table_args__ = (
-        UniqueConstraint('api_key_id', 'date', name='_api_key_date_uc'),
-    )
\ No newline at end of file
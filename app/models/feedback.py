@@ -1,6 +1,6 @@
 # app/models/feedback.py
 
-from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, Text, JSON
+from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, Text, JSON, Index
 from sqlalchemy.sql import func
 from app.database import Base
 
@@ -35,6 +35,12 @@ class Feedback(Base):
     user_id = Column(String(100))  # 将来の認証システム用
     session_id = Column(String(100))  # セッション追跡用
     
+    # 統計集計用（モデル別・期間指定の範囲スキャン）、モデル別の最新順取得用（キーセットページネーション）
+    __table_args__ = (
+        Index("ix_feedbacks_model_name_created_at", "model_name", "created_at"),
+        Index("ix_feedbacks_model_name_id", "model_name", id.desc()),
+    )
+    
     def __repr__(self):
         return f"<Feedback(id={self.id}, text='{self.text[:30]}...', model={self.model_name})>"
 
@@ -104,6 +104,17 @@ class FeedbackCreate(BaseModel):
     session_id: Optional[str] = None
 
 
+class FeedbackAccepted(BaseModel):
+    """フィードバック受付レスポンス用スキーマ（書き込みはバックグラウンドで行うためIDを含まない）"""
+    text: str
+    model_name: str
+    original_score: float
+    original_is_toxic: bool
+    user_is_toxic: bool
+    created_at: datetime
+    message: str = "フィードバックを受け付けました"
+
+
 class FeedbackResponse(BaseModel):
     """フィードバックレスポンス用スキーマ"""
     id: int
@@ -11,8 +11,7 @@ from app.models.schemas import (
 from app.services.keyword_analyzer import KeywordAnalyzer
 import logging
 
-from app.middleware.auth import verify_api_key_optional
-from app.models.api_key import APIKey
+from app.middleware.auth import verify_api_key_optional, APIKeyInfo
 from typing import Optional
 
 # ログの設定
@@ -27,7 +26,7 @@ analyzer = KeywordAnalyzer()
 @router.post("/analyze", response_model=AnalyzeResponse)
 async def analyze_text(
     request: AnalyzeRequest,
-    api_key: Optional[APIKey] = Depends(verify_api_key_optional)                   
+    api_key: Optional[APIKeyInfo] = Depends(verify_api_key_optional)                   
 ):
     """
     テキストの毒性を分析
@@ -55,7 +54,7 @@ async def analyze_text(
         )
         
         # ログに記録
-        logger.info(f"Analysis completed: score={toxicity_score:.2f}")
+        logger.debug(f"Analysis completed: score={toxicity_score:.2f}")
         return response
         
     except Exception as e:
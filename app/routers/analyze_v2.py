@@ -2,21 +2,35 @@
 Release 3 API エンドポイント
 マルチモデル統合版
 """
-from fastapi import APIRouter, HTTPException, Query
-from pydantic import BaseModel, Field
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Optional, List, Literal
 import asyncio
+import hashlib
+import os
+import orjson
 from datetime import datetime
+from cachetools import TTLCache
 
-# マルチモデルアナライザーのインポート
-from app.services.multi_model_analyzer import MultiModelAnalyzer
+from app import cache
 
 # ルーター作成
-router = APIRouter(prefix="/api/v2", tags=["analyze_v2"])
+router = APIRouter(
+    prefix="/api/v2",
+    tags=["analyze_v2"],
+    default_response_class=ORJSONResponse  # datetime・日本語をCで直接シリアライズ
+)
 
-# グローバルアナライザー（初期化は一度だけ）
-analyzer = None
-analyzer_lock = asyncio.Lock()
+# アナライザーは起動時（main.pyのlifespan）に生成し app.state.analyzer に保持する
+
+# バッチ分析の同時実行数（モデルへの同時リクエストを制限）
+# セマフォはイベントループに結び付くため、lifespanで作成して app.state.batch_semaphore に保持する
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+
+# 分析結果キャッシュ（同一テキスト・戦略の再分析を省略）
+ANALYZE_CACHE_TTL = 300
+_local_cache = TTLCache(maxsize=1024, ttl=60)  # ワーカー内のL1（ネットワーク不要）
 
 
 # リクエスト/レスポンスモデル
@@ -63,8 +77,10 @@ class AnalyzeResponseV2(BaseModel):
     model_times: Optional[dict] = Field(None, description="モデル別処理時間")
     consensus: Optional[float] = Field(None, description="モデル間の一致度")
     
-    class Config:
-        json_schema_extra = {
+    model_config = ConfigDict(
+        extra="ignore",
+        validate_assignment=False,
+        json_schema_extra={
             "example": {
                 "text": "死ね",
                 "toxicity_score": 0.85,
@@ -77,6 +93,7 @@ class AnalyzeResponseV2(BaseModel):
                 "timestamp": "2024-03-14T10:30:00"
             }
         }
+    )
 
 
 class BatchAnalyzeRequestV2(BaseModel):
@@ -96,9 +113,30 @@ class BatchAnalyzeResponseV2(BaseModel):
     average_time: float
 
 
+def _analyze_cache_key(request: AnalyzeRequestV2) -> str:
+    """テキスト内容・戦略・詳細有無から分析キャッシュのキーを生成"""
+    raw = f"{request.strategy}|{int(bool(request.include_details))}|{request.text}"
+    return "anz:" + hashlib.sha1(raw.encode()).hexdigest()
+
+
+def _is_cacheable(result: dict) -> bool:
+    """実行した全モデルが成功した結果のみキャッシュ対象とする（障害時の0.0判定を残さない）"""
+    details = result.get("details") or {}
+    if details.get("error"):
+        return False
+    return details.get("valid_models") == details.get("total_models")
+
+
+def _with_fresh_timestamp(data: dict) -> dict:
+    """キャッシュ済みのレスポンスに今回の分析日時を設定して返す"""
+    return {**data, "timestamp": datetime.now().isoformat()}
+
+
 # エンドポイント
-@router.post("/analyze", response_model=AnalyzeResponseV2)
-async def analyze_text_v2(request: AnalyzeRequestV2):
+# 分析系はハンドラ内で組み立てた値をそのまま返すため、response_modelによる再検証を行わない
+# （OpenAPIのスキーマは responses で提示する）
+@router.post("/analyze", response_model=None, responses={200: {"model": AnalyzeResponseV2}})
+async def analyze_text_v2(request: AnalyzeRequestV2, http_request: Request):
     """
     テキストの毒性を分析（マルチモデル版）
     
@@ -108,14 +146,18 @@ async def analyze_text_v2(request: AnalyzeRequestV2):
     - balanced: 全モデル並列（バランス）
     - accurate: 重み付け最適化（高精度）
     """
-    global analyzer
+    analyzer = http_request.app.state.analyzer
     
-    # アナライザーの初期化（初回のみ）
-    if analyzer is None:
-        async with analyzer_lock:
-            if analyzer is None:
-                analyzer = MultiModelAnalyzer()
-                # await analyzer.initialize()
+    # キャッシュ確認（L1: ワーカー内 → L2: Redis）
+    cache_key = _analyze_cache_key(request)
+    cached = _local_cache.get(cache_key)
+    if cached is not None:
+        return ORJSONResponse(_with_fresh_timestamp(cached))
+    
+    cached_data = await cache.get_json(cache_key)
+    if cached_data is not None:
+        _local_cache[cache_key] = cached_data
+        return ORJSONResponse(_with_fresh_timestamp(cached_data))
     
     try:
         # 分析実行
@@ -124,8 +166,8 @@ async def analyze_text_v2(request: AnalyzeRequestV2):
     		strategy=request.strategy
         )
         
-        # レスポンス作成
-        response = AnalyzeResponseV2(
+        # レスポンス作成（内部で生成した値のため検証を省略）
+        response = AnalyzeResponseV2.model_construct(
             text=request.text,
             toxicity_score=result["toxicity_score"],
             is_toxic=result["is_toxic"],
@@ -133,7 +175,8 @@ async def analyze_text_v2(request: AnalyzeRequestV2):
             primary_category=result.get("primary_category", "不明"),
             strategy=result.get("strategy", request.strategy),
             models_used=result.get("models_used", []),
-            total_time=result.get("total_time", 0.0)
+            total_time=result.get("total_time", 0.0),
+            timestamp=datetime.now()
         )
         
         # 詳細情報を含める場合
@@ -142,46 +185,49 @@ async def analyze_text_v2(request: AnalyzeRequestV2):
             response.model_times = result.get("model_times")
             response.consensus = result.get("consensus")
         
-        return response
+        data = response.model_dump(mode="json")
+        if _is_cacheable(result):
+            _local_cache[cache_key] = data
+            await cache.set_json(cache_key, data, ttl=ANALYZE_CACHE_TTL)
+        
+        return ORJSONResponse(data)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.post("/analyze/batch", response_model=BatchAnalyzeResponseV2)
-async def analyze_batch_v2(request: BatchAnalyzeRequestV2):
+@router.post("/analyze/batch", response_model=None, responses={200: {"model": BatchAnalyzeResponseV2}})
+async def analyze_batch_v2(request: BatchAnalyzeRequestV2, http_request: Request):
     """
     複数テキストの一括分析
     
     最大100件まで同時処理可能
     """
-    global analyzer
-    
-    # アナライザーの初期化
-    if analyzer is None:
-        async with analyzer_lock:
-            if analyzer is None:
-                analyzer = MultiModelAnalyzer()
-                # await analyzer.initialize()
+    analyzer = http_request.app.state.analyzer
+    batch_sem = http_request.app.state.batch_semaphore
     
     try:
         import time
-        start_time = time.time()
+        start_time = time.perf_counter()
         
-        # 並列分析
-        tasks = []
-        for text in request.texts:
-            task = analyzer.analyze_with_strategy(text=text, strategy=request.strategy)
-            tasks.append(task)
+        # 埋め込みモデル・外部APIは全テキストをまとめて実行してキャッシュに載せる
+        await analyzer.prefetch_batch(request.texts, request.strategy)
         
+        # 並列分析（同時実行数はセマフォで制限）
+        async def analyze_one(text: str):
+            async with batch_sem:
+                return await analyzer.analyze_with_strategy(text=text, strategy=request.strategy)
+        
+        tasks = [analyze_one(text) for text in request.texts]
         results_data = await asyncio.gather(*tasks, return_exceptions=True)
         
-        # 結果整形
+        # 結果整形（内部で生成した値のため検証を省略）
+        now = datetime.now()
         results = []
-        for i, (text, result) in enumerate(zip(request.texts, results_data)):
+        for text, result in zip(request.texts, results_data):
             if isinstance(result, Exception):
                 # エラーの場合はデフォルト値
-                results.append(AnalyzeResponseV2(
+                results.append(AnalyzeResponseV2.model_construct(
                     text=text,
                     toxicity_score=0.0,
                     is_toxic=False,
@@ -189,10 +235,11 @@ async def analyze_batch_v2(request: BatchAnalyzeRequestV2):
                     primary_category="エラー",
                     strategy=request.strategy,
                     models_used=[],
-                    total_time=0.0
+                    total_time=0.0,
+                    timestamp=now
                 ))
             else:
-                results.append(AnalyzeResponseV2(
+                results.append(AnalyzeResponseV2.model_construct(
                     text=text,
                     toxicity_score=result["toxicity_score"],
                     is_toxic=result["is_toxic"],
@@ -200,63 +247,70 @@ async def analyze_batch_v2(request: BatchAnalyzeRequestV2):
                     primary_category=result.get("primary_category", "不明"),
                     strategy=result.get("strategy", request.strategy),
                     models_used=result.get("models_used", []),
-                    total_time=result.get("total_time", 0.0)
+                    total_time=result.get("total_time", 0.0),
+                    timestamp=now
                 ))
         
-        total_time = time.time() - start_time
+        total_time = time.perf_counter() - start_time
         
-        return BatchAnalyzeResponseV2(
+        response = BatchAnalyzeResponseV2.model_construct(
             results=results,
             total_texts=len(request.texts),
             total_time=total_time,
             average_time=total_time / len(request.texts) if request.texts else 0
         )
+        return ORJSONResponse(response.model_dump())
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# 戦略一覧は固定の内容のため、起動時に1回だけシリアライズして使い回す
+_STRATEGIES_BODY = orjson.dumps({
+    "strategies": [
+        {
+            "name": "fast",
+            "description": "キーワードのみ使用。最速だが精度は低め",
+            "expected_accuracy": "85-90%",
+            "response_time": "< 0.01秒"
+        },
+        {
+            "name": "cascade",
+            "description": "段階的判定。高信頼度なら早期終了",
+            "expected_accuracy": "85-90%",
+            "response_time": "0.01-1秒"
+        },
+        {
+            "name": "balanced",
+            "description": "全モデル並列実行。バランス型",
+            "expected_accuracy": "95-100%",
+            "response_time": "1-2秒"
+        },
+        {
+            "name": "accurate",
+            "description": "重み付け最適化。最高精度",
+            "expected_accuracy": "95-100%",
+            "response_time": "1-2秒"
+        }
+    ]
+})
+
+
 @router.get("/strategies")
 async def get_strategies():
     """
     利用可能な分析戦略の一覧
     """
-    return {
-        "strategies": [
-            {
-                "name": "fast",
-                "description": "キーワードのみ使用。最速だが精度は低め",
-                "expected_accuracy": "85-90%",
-                "response_time": "< 0.01秒"
-            },
-            {
-                "name": "cascade",
-                "description": "段階的判定。高信頼度なら早期終了",
-                "expected_accuracy": "85-90%",
-                "response_time": "0.01-1秒"
-            },
-            {
-                "name": "balanced",
-                "description": "全モデル並列実行。バランス型",
-                "expected_accuracy": "95-100%",
-                "response_time": "1-2秒"
-            },
-            {
-                "name": "accurate",
-                "description": "重み付け最適化。最高精度",
-                "expected_accuracy": "95-100%",
-                "response_time": "1-2秒"
-            }
-        ]
-    }
+    return Response(content=_STRATEGIES_BODY, media_type="application/json")
 
 
+# モデル情報はワーカー内のアナライザーから組み立てる（Redisを経由しない）
 @router.get("/models")
-async def get_models():
+async def get_models(http_request: Request):
     """
     使用中のモデル情報
     """
-    global analyzer
+    analyzer = getattr(http_request.app.state, "analyzer", None)
     
     if analyzer is None:
         return {"models": [], "status": "not_initialized"}
@@ -286,11 +340,11 @@ async def get_models():
 
 
 @router.get("/stats")
-async def get_stats():
+async def get_stats(http_request: Request):
     """
     分析統計情報
     """
-    global analyzer
+    analyzer = getattr(http_request.app.state, "analyzer", None)
     
     if analyzer is None:
         return {"status": "not_initialized"}
@@ -304,11 +358,11 @@ async def get_stats():
 
 # ヘルスチェック
 @router.get("/health")
-async def health_check():
+async def health_check(http_request: Request):
     """
     APIヘルスチェック
     """
-    global analyzer
+    analyzer = getattr(http_request.app.state, "analyzer", None)
     
     return {
         "status": "healthy",
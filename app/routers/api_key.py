@@ -3,12 +3,13 @@ APIキー発行エンドポイント
 簡易的な実装（メール確認なし）
 """
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel, EmailStr
 from datetime import datetime
 from typing import Dict, Any
 
-from app.database import get_db
+from app.database import get_async_db
 from app.models.api_key import APIKey
 
 # ルーターの作成
@@ -33,7 +34,7 @@ class RegisterResponse(BaseModel):
 @router.post("/register", response_model=RegisterResponse)
 async def register_api_key(
     request: RegisterRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ) -> RegisterResponse:
     """
     メールアドレスを受け取ってAPIキーを発行
@@ -46,20 +47,20 @@ async def register_api_key(
         # APIキーを生成
         new_api_key = APIKey.generate_api_key()
         
-        # データベースに保存
+        # データベースにはハッシュのみ保存
         api_key_record = APIKey(
             email=request.email,
-            api_key=new_api_key,
+            api_key_hash=APIKey.hash_api_key(new_api_key),
             daily_limit=100  # 無料プラン
         )
         
         db.add(api_key_record)
-        db.commit()
-        db.refresh(api_key_record)
+        await db.commit()
+        await db.refresh(api_key_record)
         
-        # レスポンスを返す
+        # レスポンスを返す（平文のキーを返すのはこの一度だけ）
         return RegisterResponse(
-            api_key=api_key_record.api_key,
+            api_key=new_api_key,
             email=api_key_record.email,
             daily_limit=api_key_record.daily_limit,
             created_at=api_key_record.created_at,
@@ -67,7 +68,7 @@ async def register_api_key(
         )
         
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=500,
             detail=f"APIキーの発行中にエラーが発生しました: {str(e)}"
@@ -76,16 +77,19 @@ async def register_api_key(
 @router.get("/check/{api_key}")
 async def check_api_key(
     api_key: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ) -> Dict[str, Any]:
     """
     APIキーの有効性を確認（デバッグ用）
     """
     # APIキーを検索
-    api_key_record = db.query(APIKey).filter(
-        APIKey.api_key == api_key,
-        APIKey.is_active == True
-    ).first()
+    result = await db.execute(
+        select(APIKey).where(
+            APIKey.api_key_hash == APIKey.hash_api_key(api_key),
+            APIKey.is_active == True
+        )
+    )
+    api_key_record = result.scalar_one_or_none()
     
     if not api_key_record:
         raise HTTPException(
@@ -1,69 +1,76 @@
 # app/routers/feedback.py
 
+import asyncio
 from typing import List, Optional
-from datetime import datetime, timedelta
-from fastapi import APIRouter, Depends, HTTPException, Query
+from datetime import datetime, timedelta, timezone
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import and_, case, func
 
 from app.database import get_db
 from app.models.feedback import Feedback, ModelPerformance
-from app.models.schemas import FeedbackCreate, FeedbackResponse, FeedbackStats
+from app.models.schemas import FeedbackAccepted, FeedbackCreate, FeedbackResponse, FeedbackStats
+from app.services.feedback_writer import enqueue_feedback
 
 router = APIRouter(prefix="/api/v2/feedback", tags=["feedback"])
 
 
-@router.post("/", response_model=FeedbackResponse)
+@router.post("/", response_model=FeedbackAccepted, status_code=202)
 async def create_feedback(
-    feedback: FeedbackCreate,
-    db: Session = Depends(get_db)
-) -> FeedbackResponse:
-    """ユーザーフィードバックを保存"""
+    feedback: FeedbackCreate
+) -> FeedbackAccepted:
+    """
+    ユーザーフィードバックを受け付ける（202）
+    書き込みはバックグラウンドでまとめて行うため、IDは返さない（/recentで参照できる）
+    """
+    created_at = datetime.now(timezone.utc)
+    
+    # フィードバックデータを書き込み待ちに追加
     try:
-        # フィードバックデータをデータベースに保存
-        db_feedback = Feedback(
-            text=feedback.text,
-            model_name=feedback.model_name,
-            strategy=feedback.strategy,
-            original_score=feedback.original_score,
-            original_is_toxic=feedback.original_is_toxic,
-            original_categories=feedback.original_categories,
-            original_confidence=feedback.original_confidence,
-            user_is_toxic=feedback.user_is_toxic,
-            user_category=feedback.user_category,
-            user_severity=feedback.user_severity,
-            feedback_reason=feedback.feedback_reason,
-            session_id=feedback.session_id
+        enqueue_feedback({
+            "text": feedback.text,
+            "model_name": feedback.model_name,
+            "strategy": feedback.strategy,
+            "original_score": feedback.original_score,
+            "original_is_toxic": feedback.original_is_toxic,
+            "original_categories": feedback.original_categories,
+            "original_confidence": feedback.original_confidence,
+            "user_is_toxic": feedback.user_is_toxic,
+            "user_category": feedback.user_category,
+            "user_severity": feedback.user_severity,
+            "feedback_reason": feedback.feedback_reason,
+            "session_id": feedback.session_id,
+            "created_at": created_at
+        })
+    except asyncio.QueueFull:
+        # DB障害などで書き込みが滞っている：受け付けずに再送を促す
+        raise HTTPException(
+            status_code=503,
+            detail="フィードバックを受け付けられません。しばらくしてから再度お試しください。"
         )
-        
-        db.add(db_feedback)
-        db.commit()
-        db.refresh(db_feedback)
-        
-        # 精度が変わったかチェック（同意しない場合）
-        if feedback.original_is_toxic != feedback.user_is_toxic:
-            accuracy_impact = "判定精度の改善に活用されます"
-        else:
-            accuracy_impact = "判定が正しかったことを確認しました"
-        
-        return FeedbackResponse(
-            id=db_feedback.id,
-            text=db_feedback.text,
-            model_name=db_feedback.model_name,
-            original_score=db_feedback.original_score,
-            original_is_toxic=db_feedback.original_is_toxic,
-            user_is_toxic=db_feedback.user_is_toxic,
-            created_at=db_feedback.created_at,
-            message=f"フィードバックを受け付けました。{accuracy_impact}"
-        )
-        
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=500, detail=f"フィードバック保存エラー: {str(e)}")
+    
+    # 精度が変わったかチェック（同意しない場合）
+    if feedback.original_is_toxic != feedback.user_is_toxic:
+        accuracy_impact = "判定精度の改善に活用されます"
+    else:
+        accuracy_impact = "判定が正しかったことを確認しました"
+    
+    # （値はFeedbackCreateで検証済みのため再検証を省略）
+    return FeedbackAccepted.model_construct(
+        text=feedback.text,
+        model_name=feedback.model_name,
+        original_score=feedback.original_score,
+        original_is_toxic=feedback.original_is_toxic,
+        user_is_toxic=feedback.user_is_toxic,
+        created_at=created_at,
+        message=f"フィードバックを受け付けました。{accuracy_impact}"
+    )
 
 
+# 以下は同期セッションでDBを参照するため、async defにせずスレッドプールで実行させる
+# （イベントループをクエリ待ちでブロックしない）
 @router.get("/stats", response_model=FeedbackStats)
-async def get_feedback_stats(
+def get_feedback_stats(
     model_name: Optional[str] = Query(None, description="モデル名でフィルタ"),
     days: int = Query(7, description="過去何日間の統計を取得するか"),
     db: Session = Depends(get_db)
@@ -73,15 +80,21 @@ async def get_feedback_stats(
         # 期間の計算
         since = datetime.now() - timedelta(days=days)
         
-        # クエリの基本条件
-        query = db.query(Feedback).filter(Feedback.created_at >= since)
+        # モデル別の件数・正解数・偽陽性・偽陰性をSQLで集計（行はモデル数だけ返る）
+        query = db.query(
+            Feedback.model_name,
+            func.count().label("total"),
+            func.sum(case((Feedback.original_is_toxic == Feedback.user_is_toxic, 1), else_=0)).label("correct"),
+            func.sum(case((and_(Feedback.original_is_toxic == True, Feedback.user_is_toxic == False), 1), else_=0)).label("false_positives"),
+            func.sum(case((and_(Feedback.original_is_toxic == False, Feedback.user_is_toxic == True), 1), else_=0)).label("false_negatives")
+        ).filter(Feedback.created_at >= since)
         
         # モデル名でフィルタ
         if model_name:
             query = query.filter(Feedback.model_name == model_name)
         
-        feedbacks = query.all()
-        total = len(feedbacks)
+        rows = query.group_by(Feedback.model_name).all()
+        total = sum(row.total for row in rows)
         
         if total == 0:
             return FeedbackStats(
@@ -92,19 +105,16 @@ async def get_feedback_stats(
                 model_performance={}
             )
         
-        # 統計計算
-        correct = sum(1 for f in feedbacks if f.original_is_toxic == f.user_is_toxic)
-        false_positives = sum(1 for f in feedbacks if f.original_is_toxic and not f.user_is_toxic)
-        false_negatives = sum(1 for f in feedbacks if not f.original_is_toxic and f.user_is_toxic)
+        # 全体の統計はモデル別の集計結果を合算
+        correct = sum(row.correct for row in rows)
+        false_positives = sum(row.false_positives for row in rows)
+        false_negatives = sum(row.false_negatives for row in rows)
         
-        # モデル別の精度計算
-        model_performance = {}
-        models = set(f.model_name for f in feedbacks)
-        
-        for model in models:
-            model_feedbacks = [f for f in feedbacks if f.model_name == model]
-            model_correct = sum(1 for f in model_feedbacks if f.original_is_toxic == f.user_is_toxic)
-            model_performance[model] = model_correct / len(model_feedbacks) if model_feedbacks else 0.0
+        # モデル別の精度
+        model_performance = {
+            row.model_name: row.correct / row.total
+            for row in rows
+        }
         
         return FeedbackStats(
             total_feedbacks=total,
@@ -119,21 +129,42 @@ async def get_feedback_stats(
 
 
 @router.get("/recent", response_model=List[FeedbackResponse])
-async def get_recent_feedbacks(
+def get_recent_feedbacks(
+    response: Response,
     limit: int = Query(10, ge=1, le=100),
+    before_id: Optional[int] = Query(None, description="このIDより前のフィードバックを取得（X-Next-Cursorの値）"),
     model_name: Optional[str] = None,
     db: Session = Depends(get_db)
 ) -> List[FeedbackResponse]:
-    """最近のフィードバックを取得"""
-    query = db.query(Feedback)
+    """最近のフィードバックを取得（IDによるキーセットページネーション）"""
+    # レスポンスに必要な列だけを取得（JSON列などを読み込まない）
+    query = db.query(
+        Feedback.id,
+        Feedback.text,
+        Feedback.model_name,
+        Feedback.original_score,
+        Feedback.original_is_toxic,
+        Feedback.user_is_toxic,
+        Feedback.created_at
+    )
     
     if model_name:
         query = query.filter(Feedback.model_name == model_name)
     
-    feedbacks = query.order_by(Feedback.created_at.desc()).limit(limit).all()
+    # OFFSETを使わず、前ページ最後のIDから続きを取得
+    if before_id is not None:
+        query = query.filter(Feedback.id < before_id)
+    
+    # IDは挿入順に増加するため、新しい順 = IDの降順
+    feedbacks = query.order_by(Feedback.id.desc()).limit(limit).all()
+    
+    # 次ページのカーソル（件数がlimitに満たない場合は最終ページ）
+    if len(feedbacks) == limit:
+        response.headers["X-Next-Cursor"] = str(feedbacks[-1].id)
     
+    # DBから読んだ値のため検証を省略してレスポンスを構築
     return [
-        FeedbackResponse(
+        FeedbackResponse.model_construct(
             id=f.id,
             text=f.text,
             model_name=f.model_name,
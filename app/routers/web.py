@@ -2,16 +2,40 @@
 Webインターフェース用ルーター
 ランディングページとデモ機能を提供
 """
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Request, Response
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
 from pathlib import Path
+from typing import Dict
+import orjson
 
 
 # テンプレートディレクトリの設定
 templates_dir = Path(__file__).parent.parent.parent / "templates"
 templates = Jinja2Templates(directory=str(templates_dir))
 
+# テンプレートファイルの更新は確認しない（描画結果は下記で保持するため）
+templates.env.auto_reload = False
+
+# テンプレートは変数を使わない静的なHTMLのため、描画結果をテンプレート名ごとに保持
+_rendered_pages: Dict[str, bytes] = {}
+
+
+def _render_page(name: str) -> HTMLResponse:
+    """テンプレートを初回のみ描画し、以降は同じHTMLを返す"""
+    content = _rendered_pages.get(name)
+    if content is None:
+        content = templates.get_template(name).render().encode("utf-8")
+        _rendered_pages[name] = content
+    return HTMLResponse(content=content)
+
+# ヘルスチェックの応答は固定のため起動時に1回だけシリアライズ
+_HEALTH_BODY = orjson.dumps({
+    "status": "healthy",
+    "service": "ToxiGuard API Web Interface",
+    "version": "4.0.0"
+})
+
 # ルーター作成
 router = APIRouter(
     tags=["web"],
@@ -21,29 +45,19 @@ router = APIRouter(
 @router.get("/", response_class=HTMLResponse)
 async def home(request: Request):
     """ランディングページを表示"""
-    return templates.TemplateResponse(
-        "index.html",
-        {"request": request}
-    )
+    return _render_page("index.html")
 
 @router.get("/demo", response_class=HTMLResponse)
 async def demo_page(request: Request):
     """デモページを表示（将来的に別ページにする場合用）"""
-    return templates.TemplateResponse(
-        "index.html",  # 現在はホームページと同じ
-        {"request": request}
-    )
+    return _render_page("index.html")  # 現在はホームページと同じ
 
 @router.get("/api-key", response_class=HTMLResponse)
 async def api_key_page(request: Request):
     """APIキー発行ページ"""
-    return templates.TemplateResponse("api_key.html", {"request": request})
+    return _render_page("api_key.html")
 
 @router.get("/health")
 async def health_check():
     """ヘルスチェックエンドポイント"""
-    return {
-        "status": "healthy",
-        "service": "ToxiGuard API Web Interface",
-        "version": "4.0.0"
-    }
\ No newline at end of file
+    return Response(content=_HEALTH_BODY, media_type="application/json")
\ No newline at end of file
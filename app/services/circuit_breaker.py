@@ -0,0 +1,70 @@
+"""
+外部APIのサーキットブレーカー
+上流の障害中は呼び出しを止めてすぐにフォールバック結果を返し、タイムアウト待ちでリクエストを滞留させない
+"""
+import logging
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """サーキットブレーカーが開いているため呼び出さなかった"""
+
+
+class CircuitBreaker:
+    """
+    連続失敗で呼び出しを一時停止するサーキットブレーカー
+
+    - failure_threshold回連続で失敗すると開き、reset_timeout秒間は呼び出しを止める
+    - 経過後は試行を1回だけ通し（半開）、成功すれば閉じ、失敗すれば再び開く
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_started_at: Optional[float] = None
+        # 同期版の分析はスレッドから呼ばれるためロックで保護
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """呼び出してよいか（半開状態では試行中の1回のみ許可）"""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            now = time.monotonic()
+            if now - self._opened_at < self.reset_timeout:
+                return False
+            # 試行がキャンセル等で結果を返さなかった場合もreset_timeout後に次の試行を許可
+            if self._trial_started_at is not None and now - self._trial_started_at < self.reset_timeout:
+                return False
+            self._trial_started_at = now
+            return True
+
+    def on_success(self) -> None:
+        """上流から応答があった：閉じる"""
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info(f"{self.name}の呼び出しを再開します")
+            self._failures = 0
+            self._opened_at = None
+            self._trial_started_at = None
+
+    def on_failure(self) -> None:
+        """上流の障害（接続エラー・タイムアウト・429・5xx）：規定回数に達したら開く"""
+        with self._lock:
+            self._failures += 1
+            self._trial_started_at = None
+            if self._opened_at is None and self._failures < self.failure_threshold:
+                return
+            if self._opened_at is None:
+                logger.warning(
+                    f"{self.name}で{self._failures}回連続のエラーが発生したため、"
+                    f"{self.reset_timeout:.0f}秒間呼び出しを停止します"
+                )
+            self._opened_at = time.monotonic()
@@ -5,17 +5,31 @@ Release 4: 外部API統合
 """
 import asyncio
 import json
-import concurrent.futures
-from typing import Dict, Optional, Tuple, List
+import re
+import time
+import unicodedata
+from typing import Dict, Tuple, List
 import logging
 from datetime import datetime
-from anthropic import Anthropic, APIError, APITimeoutError
+from anthropic import Anthropic, AsyncAnthropic, APIError, APITimeoutError, RateLimitError
 
 from app.config import settings, API_SPECIFIC_CONFIG
 from app.models.schemas import ToxicityCategory
+from app.services.rate_limiter import AdaptiveRateLimiter
+from app.services.result_cache import ResultCache
 
 logger = logging.getLogger(__name__)
 
+# レスポンスのラベル付きの行（「総合スコア: 0.8」など）
+_RESPONSE_LINE_RE = re.compile(r'^[ \t]*(総合スコア|カテゴリ|理由|検出語句):(.*)$', re.M)
+
+# カテゴリ・検出語句の区切り（カンマ・読点）
+_LIST_SPLIT_RE = re.compile(r'[,、]')
+
+# 連続する空白（改行を含む）
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
 
 class ClaudeAnalyzer:
     """Claude APIを使用した毒性分析"""
@@ -24,21 +38,47 @@ class ClaudeAnalyzer:
         """Claude APIクライアントの初期化"""
         self.api_key = settings.ANTHROPIC_API_KEY
         self.client = None
+        self.aclient = None
         self.config = API_SPECIFIC_CONFIG.get("claude", {})
         self.model_name = self.config.get("model", "claude-3-haiku-20240307")
         
-        # キャッシュ（コスト削減のため）
-        self._cache = {}
+        # APIへ送るテキストの上限文字数（入力トークンの削減）
+        self._max_input_chars = self.config.get("max_input_chars", 2000)
+        
+        # プロンプトの固定部分は一度だけ生成
+        self._prompt_prefix, self._prompt_suffix = self._build_prompt_template()
+        
+        # キャッシュ（コスト削減のため。Redisが設定されていれば全ワーカーで共有）
         self._cache_size = 100
+        self._cache = ResultCache(maxsize=self._cache_size, namespace="claude")
+        
+        # 処理中のテキスト→結果のFuture（同一テキストへの同時リクエストはAPI呼び出しを共有）
+        self._inflight: Dict[str, asyncio.Future] = {}
+        
+        # 非同期API呼び出しの同時実行数を制限
+        self._api_semaphore = asyncio.Semaphore(self.config.get("max_concurrency", 8))
+        
+        # 毎秒の呼び出し数の制限（レート制限エラーに応じて自動で速度を調整）
+        rate_limit = self.config.get("rate_limit", 0)
+        self._rate_limiter = AdaptiveRateLimiter(rate_limit) if rate_limit > 0 else None
         
         # APIキーが設定されている場合のみクライアントを初期化
         if self.api_key:
             try:
-                self.client = Anthropic(api_key=self.api_key)
+                # 同期版はanalyze()用、非同期版はanalyze_text()用
+                # 429/5xxはSDKがRetry-Afterを優先しつつジッター付き指数バックオフで再試行する
+                client_options = {
+                    "api_key": self.api_key,
+                    "timeout": settings.EXTERNAL_API_TIMEOUT,
+                    "max_retries": self.config.get("max_retries", 3)
+                }
+                self.client = Anthropic(**client_options)
+                self.aclient = AsyncAnthropic(**client_options)
                 logger.info(f"Claude APIクライアント初期化成功: {self.model_name}")
             except Exception as e:
                 logger.error(f"Claude APIクライアント初期化エラー: {e}")
                 self.client = None
+                self.aclient = None
         else:
             logger.warning("Claude APIキーが設定されていません")
     
@@ -52,45 +92,66 @@ class ClaudeAnalyzer:
         Returns:
             (総合スコア, カテゴリリスト, 信頼度)
         """
-        # 非同期メソッドを同期的に実行
+        # 同期SDKを直接呼び出す（イベントループを生成しない）
         try:
-            # 既存のイベントループをチェック
-            try:
-                loop = asyncio.get_running_loop()
-                # イベントループが実行中の場合、別スレッドで実行
-                import concurrent.futures
-                with concurrent.futures.ThreadPoolExecutor() as executor:
-                    future = executor.submit(asyncio.run, self.analyze_text(text))
-                    result = future.result()
-            except RuntimeError:
-                # イベントループが実行中でない場合
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                try:
-                    result = loop.run_until_complete(self.analyze_text(text))
-                finally:
-                    loop.close()
-            
-            # 結果を既存インターフェースに変換
-            score = result.get('toxicity_score', 0.0)
-            confidence = result.get('confidence', 0.5)
-            
-            # カテゴリを変換
-            categories = []
-            for cat_detail in result.get('categories_detail', []):
-                category = ToxicityCategory(
-                    name=cat_detail['name'],
-                    score=cat_detail['score'],
-                    keywords_found=cat_detail.get('keywords', [])
-                )
-                categories.append(category)
-            
-            return score, categories, confidence
-            
+            return self._to_tuple(self._analyze_sync(text))
         except Exception as e:
             logger.error(f"分析エラー: {str(e)}")
             return 0.0, [], 0.0
     
+    async def analyze_async(self, text: str) -> Tuple[float, List[ToxicityCategory], float]:
+        """analyzeの非同期版（スレッドを使わずイベントループ上でAPIを待機）"""
+        try:
+            return self._to_tuple(await self.analyze_text(text))
+        except Exception as e:
+            logger.error(f"分析エラー: {str(e)}")
+            return 0.0, [], 0.0
+    
+    def _to_tuple(self, result: Dict) -> Tuple[float, List[ToxicityCategory], float]:
+        """分析結果の辞書を既存インターフェース（スコア, カテゴリ, 信頼度）に変換"""
+        score = result.get('toxicity_score', 0.0)
+        confidence = result.get('confidence', 0.5)
+        
+        # カテゴリを変換
+        categories = []
+        for cat_detail in result.get('categories_detail', []):
+            category = ToxicityCategory(
+                name=cat_detail['name'],
+                score=cat_detail['score'],
+                keywords_found=cat_detail.get('keywords', [])
+            )
+            categories.append(category)
+        
+        return score, categories, confidence
+    
+    def _analyze_sync(self, text: str) -> Dict:
+        """
+        テキストの毒性を分析（同期版。呼び出し元のスレッドでAPIを呼ぶ）
+        
+        Args:
+            text: 分析対象のテキスト
+            
+        Returns:
+            分析結果の辞書
+        """
+        text = self._normalize(text)
+        cached_result = self._cache.get(text)
+        if cached_result is not None:
+            return self._mark_cached(text, cached_result)
+        
+        # APIが利用できない場合はデフォルト値を返す
+        if not self.client or not settings.USE_EXTERNAL_APIS:
+            return self._get_default_result(text)
+        
+        try:
+            response = self._call_claude_api(self._create_prompt(text))
+        except Exception as e:
+            return self._handle_api_error(e, text)
+        
+        result = self._parse_response(response, text)
+        self._update_cache(text, result)
+        return result
+    
     async def analyze_text(self, text: str) -> Dict:
         """
         テキストの毒性を分析（内部API用）
@@ -101,54 +162,107 @@ class ClaudeAnalyzer:
         Returns:
             分析結果の辞書
         """
+        text = self._normalize(text)
+        cached_result = await self._cache.aget(text)
+        if cached_result is not None:
+            return self._mark_cached(text, cached_result)
+        
+        # APIが利用できない場合はデフォルト値を返す
+        if not self.aclient or not settings.USE_EXTERNAL_APIS:
+            return self._get_default_result(text)
+        
+        # 同じテキストを処理中のリクエストがあれば、その結果を待つ
+        pending = self._inflight.get(text)
+        if pending is not None:
+            # 待機側のキャンセルが処理中のFutureに波及しないようshieldする
+            result = await asyncio.shield(pending)
+            if result is not None:
+                return result.copy()
+            # 先行リクエストがキャンセルされた場合は自分で呼び出す
+            return await self._request_analysis(text)
+        
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[text] = future
+        result = None
         try:
-            # キャッシュチェック
-            if text in self._cache:
-                logger.debug(f"キャッシュヒット: {text[:30]}...")
-                cached_result = self._cache[text].copy()
-                cached_result["details"]["cached"] = True
-                return cached_result
-            
-            # APIが利用できない場合はデフォルト値を返す
-            if not self.client or not settings.USE_EXTERNAL_APIS:
-                return self._get_default_result(text)
-            
-            # Claude APIへのプロンプト作成
-            prompt = self._create_prompt(text)
-            
-            # 非同期でAPI呼び出し
-            loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(
-                None,
-                self._call_claude_api,
-                prompt
-            )
-            
-            # レスポンスの解析
-            result = self._parse_response(response, text)
-            
-            # キャッシュに保存
-            self._update_cache(text, result)
-            
+            result = await self._request_analysis(text)
             return result
+        finally:
+            del self._inflight[text]
+            future.set_result(result)
+    
+    async def _request_analysis(self, text: str) -> Dict:
+        """Claude APIを呼び出して結果をキャッシュに保存"""
+        try:
+            async with self._api_semaphore:
+                if self._rate_limiter:
+                    await self._rate_limiter.acquire()
+                response = await self._call_claude_api_async(self._create_prompt(text))
+        except Exception as e:
+            if self._rate_limiter and isinstance(e, RateLimitError):
+                self._rate_limiter.on_rate_limited()
+            return self._handle_api_error(e, text)
+        
+        if self._rate_limiter:
+            self._rate_limiter.on_success()
+        
+        result = self._parse_response(response, text)
+        await self._cache.aput(text, result)
+        return result
+    
+    async def aclose(self) -> None:
+        """非同期クライアントの接続プールを閉じる（終了時にlifespanから呼ぶ）"""
+        if self.aclient is not None:
+            await self.aclient.close()
+    
+    async def analyze_many(self, texts: List[str], concurrency: int = 8) -> List[Dict]:
+        """
+        複数テキストをまとめて分析（同一テキストへのAPI呼び出しは1回のみ）
+        
+        Args:
+            texts: 分析対象のテキストリスト
+            concurrency: API同時呼び出し数の上限
             
-        except APITimeoutError:
+        Returns:
+            textsと同じ順序の分析結果リスト
+        """
+        sem = asyncio.Semaphore(concurrency)
+        normalized = [self._normalize(text) for text in texts]
+        unique_texts = list(dict.fromkeys(normalized))
+        
+        async def analyze_one(text: str) -> Dict:
+            async with sem:
+                return await self.analyze_text(text)
+        
+        results = await asyncio.gather(*(analyze_one(text) for text in unique_texts))
+        by_text = dict(zip(unique_texts, results))
+        return [by_text[text].copy() for text in normalized]
+    
+    def _normalize(self, text: str) -> str:
+        """全角・半角の表記ゆれと空白をまとめて上限文字数で切り詰める（キャッシュキーとプロンプトの両方に使用）"""
+        return _WHITESPACE_RE.sub(" ", unicodedata.normalize("NFKC", text)).strip()[:self._max_input_chars]
+    
+    def _mark_cached(self, text: str, cached_result: Dict) -> Dict:
+        """キャッシュから取得した結果に印を付ける"""
+        logger.debug(f"キャッシュヒット: {text[:30]}...")
+        cached_result["details"] = {**cached_result["details"], "cached": True}
+        return cached_result
+    
+    def _handle_api_error(self, error: Exception, text: str) -> Dict:
+        """API呼び出しの例外をログに記録し、デフォルト結果を返す"""
+        if isinstance(error, APITimeoutError):
             logger.error(f"Claude APIタイムアウト: {text[:50]}...")
-            return self._get_default_result(text)
-            
-        except APIError as e:
-            logger.error(f"Claude APIエラー: {e}")
-            return self._get_default_result(text)
-            
-        except Exception as e:
-            logger.error(f"予期しないエラー: {e}")
-            return self._get_default_result(text)
+        elif isinstance(error, APIError):
+            logger.error(f"Claude APIエラー: {error}")
+        else:
+            logger.error(f"予期しないエラー: {error}")
+        return self._get_default_result(text)
     
-    def _create_prompt(self, text: str) -> str:
-        """Claude API用のプロンプトを作成"""
+    def _build_prompt_template(self) -> Tuple[str, str]:
+        """プロンプトの固定部分（テキストの前後）を生成"""
         system_prompt = self.config.get("system_prompt", "")
         
-        return f"""{system_prompt}
+        prefix = f"""{system_prompt}
 
 以下の日本語テキストの毒性を分析してください。
 0.0（完全に安全）から1.0（非常に有害）のスコアと、該当するカテゴリを判定してください。
@@ -161,34 +275,32 @@ class ClaudeAnalyzer:
 - 差別的表現: 差別を含む表現
 - 軽度の毒性: バカ、アホ等の軽い悪口
 
-テキスト: "{text}"
+テキスト: \""""
+        
+        suffix = """"
 
 以下の形式で回答してください：
 総合スコア: [0.0-1.0の数値]
 カテゴリ: [該当するカテゴリ名（日本語、複数可）]
 理由: [判定理由を簡潔に]
 検出語句: [毒性のある具体的な語句（カンマ区切り）]"""
+        
+        return prefix, suffix
+    
+    def _create_prompt(self, text: str) -> str:
+        """Claude API用のプロンプトを作成"""
+        return self._prompt_prefix + text + self._prompt_suffix
     
     def _call_claude_api(self, prompt: str) -> str:
         """Claude APIを同期的に呼び出し"""
-        start_time = datetime.now()
+        start_time = time.perf_counter()
         
         try:
-            message = self.client.messages.create(
-                model=self.model_name,
-                max_tokens=self.config.get("max_tokens", 200),
-                temperature=self.config.get("temperature", 0),
-                messages=[
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ]
-            )
+            message = self.client.messages.create(**self._message_params(prompt))
             
             # API呼び出し時間を記録
-            elapsed_time = (datetime.now() - start_time).total_seconds()
-            logger.info(f"Claude API応答時間: {elapsed_time:.2f}秒")
+            elapsed_time = time.perf_counter() - start_time
+            logger.debug(f"Claude API応答時間: {elapsed_time:.2f}秒")
             
             return message.content[0].text
             
@@ -196,48 +308,73 @@ class ClaudeAnalyzer:
             logger.error(f"Claude API呼び出しエラー: {e}")
             raise
     
+    async def _call_claude_api_async(self, prompt: str) -> str:
+        """Claude APIを非同期に呼び出し（スレッドを使わずイベントループ上で待機）"""
+        start_time = time.perf_counter()
+        
+        try:
+            message = await self.aclient.messages.create(**self._message_params(prompt))
+            
+            # API呼び出し時間を記録
+            elapsed_time = time.perf_counter() - start_time
+            logger.debug(f"Claude API応答時間: {elapsed_time:.2f}秒")
+            
+            return message.content[0].text
+            
+        except Exception as e:
+            logger.error(f"Claude API呼び出しエラー: {e}")
+            raise
+    
+    def _message_params(self, prompt: str) -> Dict:
+        """messages.createに渡すパラメータ（同期・非同期で共通）"""
+        return {
+            "model": self.model_name,
+            "max_tokens": self.config.get("max_tokens", 200),
+            "temperature": self.config.get("temperature", 0),
+            "messages": [
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ]
+        }
+    
     def _parse_response(self, response: str, original_text: str) -> Dict:
         """Claude APIのレスポンスを解析"""
         try:
-            # レスポンスから情報を抽出
-            lines = response.strip().split('\n')
+            # レスポンスから情報を抽出（ラベル付きの行を1回の走査で取り出す）
             total_score = 0.0
             categories = []
             reason = ""
             detected_words = []
             
-            for line in lines:
-                line = line.strip()
-                if line.startswith("総合スコア:"):
-                    score_str = line.replace("総合スコア:", "").strip()
+            for match in _RESPONSE_LINE_RE.finditer(response):
+                label, value = match.group(1), match.group(2).strip()
+                
+                if label == "総合スコア":
                     try:
-                        total_score = float(score_str)
+                        total_score = float(value)
                         total_score = max(0.0, min(1.0, total_score))
                     except ValueError:
-                        logger.warning(f"スコア解析エラー: {score_str}")
+                        logger.warning(f"スコア解析エラー: {value}")
                         
-                elif line.startswith("カテゴリ:"):
-                    category_str = line.replace("カテゴリ:", "").strip()
-                    
+                elif label == "カテゴリ":
                     # なし、none、該当なしの場合はスキップ
-                    if category_str.lower() in ["なし", "none", "該当なし", "無し"]:
+                    if value.lower() in ["なし", "none", "該当なし", "無し"]:
                         continue
                     
                     # 複数カテゴリ対応
-                    import re
-                    cats = re.split(r'[,、]', category_str)
-                    for cat in cats:
+                    for cat in _LIST_SPLIT_RE.split(value):
                         cat = cat.strip()
                         if cat:
                             categories.append(cat)
                             
-                elif line.startswith("理由:"):
-                    reason = line.replace("理由:", "").strip()
+                elif label == "理由":
+                    reason = value
                     
-                elif line.startswith("検出語句:"):
-                    words_str = line.replace("検出語句:", "").strip()
-                    if words_str and words_str.lower() not in ["なし", "none", "該当なし"]:
-                        detected_words = [w.strip() for w in re.split(r'[,、]', words_str) if w.strip()]
+                elif label == "検出語句":
+                    if value and value.lower() not in ["なし", "none", "該当なし"]:
+                        detected_words = [w.strip() for w in _LIST_SPLIT_RE.split(value) if w.strip()]
             
             # カテゴリ詳細の作成
             categories_detail = []
@@ -285,14 +422,12 @@ class ClaudeAnalyzer:
             return self._get_default_result(original_text)
     
     def _update_cache(self, text: str, result: Dict) -> None:
-        """キャッシュを更新"""
-        # キャッシュサイズ制限
-        if len(self._cache) >= self._cache_size:
-            # 最も古いエントリを削除
-            oldest_key = next(iter(self._cache))
-            del self._cache[oldest_key]
-        
-        self._cache[text] = result.copy()
+        """キャッシュを更新（上限超過時は最も長く使われていないものを破棄）"""
+        self._cache.put(text, result)
+    
+    def get_cache_stats(self) -> Dict:
+        """キャッシュの統計情報（件数・命中率）"""
+        return self._cache.get_stats()
     
     def _get_default_result(self, text: str = "") -> Dict:
         """APIが利用できない場合のデフォルト結果"""
@@ -0,0 +1,152 @@
+"""
+フィードバックの一括書き込み
+リクエストごとにコミットせず、キューに溜めたフィードバックをまとめてINSERTする
+"""
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+from sqlalchemy import insert
+
+from app.database import SessionLocal
+from app.models.feedback import Feedback
+
+logger = logging.getLogger(__name__)
+
+# 書き込み間隔（秒）：この時間内に溜まった分をまとめて書き込む
+FLUSH_INTERVAL = 2
+
+# 1回の書き込み件数（この件数に達したら間隔を待たずに書き込む）
+BATCH_SIZE = 100
+
+# 終了時にまとめて書き込む際の上限（大きすぎるexecutemanyを避ける）
+MAX_BATCH_SIZE = 500
+
+# 書き込み待ちの上限（DB障害中にメモリを使い切らないよう、超えた分は受け付けない）
+MAX_QUEUE_SIZE = 10_000
+
+# 失敗したバッチの再試行回数（超えた場合は1件ずつ書き込み、書き込めない行は破棄する）
+MAX_RETRIES = 5
+
+# 書き込み待ちのフィードバック（満杯時のenqueue_feedbackはasyncio.QueueFullを送出）
+# キューは作成時のイベントループに結び付くため、lifespanでopen_feedback_queueを呼んで作成する
+_queue: "Optional[asyncio.Queue[Dict]]" = None
+
+# 書き込みに失敗し再試行を待つバッチ（キュー内の行より先に到着したため、先に書き込む）
+# IDを到着順に採番し、IDによるキーセットページネーションの順序を保つ
+_retry_rows: List[Dict] = []
+_retry_count = 0
+
+
+def open_feedback_queue() -> None:
+    """実行中のイベントループ用に書き込み待ちキューを作成（lifespanでfeedback_flush_loopの起動前に呼ぶ）"""
+    global _queue
+    _queue = asyncio.Queue(maxsize=MAX_QUEUE_SIZE)
+
+
+def enqueue_feedback(data: Dict) -> None:
+    """フィードバック（Feedbackの列名をキーとするdict）を書き込み待ちに追加"""
+    if _queue is None:
+        raise RuntimeError("フィードバックの書き込みキューが作成されていません（open_feedback_queueを呼んでください）")
+    _queue.put_nowait(data)
+
+
+def _insert_feedbacks(rows: List[Dict]) -> None:
+    """1トランザクションでまとめてINSERT（executemany）"""
+    with SessionLocal() as db:
+        db.execute(insert(Feedback), rows)
+        db.commit()
+
+
+def _insert_feedbacks_one_by_one(rows: List[Dict]) -> int:
+    """1件ずつINSERTし、書き込めた件数を返す（制約違反などの不正な行を切り分けて破棄）"""
+    written = 0
+    with SessionLocal() as db:
+        for row in rows:
+            try:
+                db.execute(insert(Feedback), [row])
+                db.commit()
+                written += 1
+            except Exception as e:
+                db.rollback()
+                logger.error(f"フィードバックを書き込めないため破棄します: {e}")
+    return written
+
+
+async def _write_batch(rows: List[Dict]) -> bool:
+    """
+    まとめて書き込む（失敗した場合は再試行待ちとして保持し、Falseを返す）
+    MAX_RETRIES回続けて失敗したバッチは1件ずつ書き込み、書き込めない行は破棄する
+    """
+    global _retry_rows, _retry_count
+    try:
+        # 同期ドライバのためイベントループを塞がないよう別スレッドで実行
+        await asyncio.to_thread(_insert_feedbacks, rows)
+    except Exception as e:
+        _retry_count += 1
+        if _retry_count < MAX_RETRIES:
+            logger.error(f"フィードバックの書き込みエラー（{len(rows)}件を再試行します）: {e}")
+            _retry_rows = rows
+            return False
+        logger.error(f"フィードバックの書き込みエラー（{_retry_count}回失敗したため1件ずつ書き込みます）: {e}")
+        written = await asyncio.to_thread(_insert_feedbacks_one_by_one, rows)
+        if written < len(rows):
+            logger.error(f"フィードバック{len(rows) - written}件を破棄しました")
+    _retry_rows = []
+    _retry_count = 0
+    return True
+
+
+def _take_rows(limit: int) -> List[Dict]:
+    """キューから最大limit件を取り出す"""
+    rows = []
+    while _queue is not None and not _queue.empty() and len(rows) < limit:
+        rows.append(_queue.get_nowait())
+    return rows
+
+
+async def flush_feedbacks() -> int:
+    """再試行待ち・キューに残っているフィードバックをすべて書き込み、書き込んだ件数を返す"""
+    written = 0
+    while _retry_rows or (_queue is not None and not _queue.empty()):
+        rows = _retry_rows or _take_rows(MAX_BATCH_SIZE)
+        if not await _write_batch(rows):
+            break
+        written += len(rows)
+    return written
+
+
+async def feedback_flush_loop(interval: float = FLUSH_INTERVAL) -> None:
+    """lifespanから起動するバックグラウンドタスク"""
+    global _retry_rows
+    loop = asyncio.get_running_loop()
+
+    while True:
+        if _retry_rows:
+            # 失敗したバッチを新しい行より先に再試行する
+            if not await _write_batch(_retry_rows):
+                await asyncio.sleep(interval)
+            continue
+        
+        # 最初の1件を待ち、そこから一定時間または一定件数まで溜める
+        rows = [await _queue.get()]
+        deadline = loop.time() + interval
+        try:
+            while len(rows) < BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    rows.append(await asyncio.wait_for(_queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+        except asyncio.CancelledError:
+            # 終了時は溜めていた分を先頭に戻し、flush_feedbacksで書き込む
+            _retry_rows = rows
+            raise
+
+        if await _write_batch(rows):
+            logger.debug(f"フィードバックを書き込みました: {len(rows)}件")
+        else:
+            # DB障害中に再試行が空回りしないよう待機
+            await asyncio.sleep(interval)
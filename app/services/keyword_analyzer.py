@@ -3,28 +3,49 @@
 リリース1のコア機能
 完全修正版
 """
-import json
 import re
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
+
+import orjson
 from app.models.schemas import ToxicityCategory
 import logging
-import os
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
 
 logger = logging.getLogger(__name__)
 
+# 連続する空白（改行を含む）
+_WHITESPACE_RE = re.compile(r'\s+')
+
+# 全角英数字→半角の変換表
+_FULLWIDTH_TABLE = str.maketrans(
+    'ＡＢＣＤＥＦＧＨＩＪＫＬＭＮＯＰＱＲＳＴＵＶＷＸＹＺａｂｃｄｅｆｇｈｉｊｋｌｍｎｏｐｑｒｓｔｕｖｗｘｙｚ０１２３４５６７８９',
+    'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789'
+)
+
 class KeywordAnalyzer:
     """キーワードベースの毒性分析器"""
     
+    # 読み込み済みのキーワードデータ（v1ルーターとMultiModelAnalyzerの各インスタンスで共有）
+    _data_cache: Optional[Dict] = None
+    
     def __init__(self):
         """初期化：キーワードデータを読み込む"""
         self.data = self._load_keywords()
         self.categories = self.data["categories"]
         self.modifiers = self.data["modifiers"]
+        self._automaton = self._build_automaton()
         logger.info("KeywordAnalyzer initialized")
         
     def _load_keywords(self) -> Dict:
-        """キーワードデータを読み込む"""
+        """キーワードデータを読み込む（ファイルの読み込みはプロセスで1回のみ）"""
+        if KeywordAnalyzer._data_cache is not None:
+            return KeywordAnalyzer._data_cache
+        
         # Docker環境とローカル環境の両方に対応
         possible_paths = [
             "/app/app/data/toxic_keywords.json",  # Docker環境
@@ -34,7 +55,7 @@ class KeywordAnalyzer:
         
         data_path = None
         for path in possible_paths:
-            if os.path.exists(str(path)):
+            if Path(path).is_file():
                 data_path = path
                 logger.info(f"Found toxic_keywords.json at: {path}")
                 break
@@ -44,22 +65,64 @@ class KeywordAnalyzer:
                 f"toxic_keywords.json not found. Searched paths: {possible_paths}"
             )
         
-        with open(data_path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        KeywordAnalyzer._data_cache = orjson.loads(Path(data_path).read_bytes())
+        return KeywordAnalyzer._data_cache
+    
+    def _build_automaton(self):
+        """全カテゴリのキーワード（強調語付きを含む）からAho-Corasickオートマトンを構築"""
+        self._all_words = set()
+        # キーワード→それを含むカテゴリID（ヒットしたカテゴリだけを採点するため）
+        self._keyword_categories: Dict[str, List[str]] = {}
+        for category_id, category_data in self.categories.items():
+            for keyword in category_data["keywords"]:
+                self._all_words.add(keyword)
+                self._keyword_categories.setdefault(keyword, []).append(category_id)
+                for intensifier in self.modifiers["intensifiers"]:
+                    self._all_words.add(f"{intensifier}{keyword}")
+        
+        if ahocorasick is None:
+            logger.info("pyahocorasickが未インストールのため部分文字列検索を使用します")
+            return None
+        
+        automaton = ahocorasick.Automaton()
+        for word in self._all_words:
+            automaton.add_word(word, word)
+        automaton.make_automaton()
+        return automaton
+    
+    def _find_words(self, text: str) -> set:
+        """テキストに含まれるキーワードを1回の走査で列挙"""
+        if self._automaton is None:
+            return {word for word in self._all_words if word in text}
+        return {word for _, word in self._automaton.iter(text)}
     
     def analyze(self, text: str) -> Tuple[float, List[ToxicityCategory], float]:
         """テキストを分析して毒性スコアを返す"""
         # 1. テキストの前処理
         normalized_text = self._normalize_text(text)
+        found_words = self._find_words(normalized_text)
+        
+        # キーワードが1つもなければカテゴリを調べるまでもない（大半の入力）
+        if not found_words:
+            return 0.0, [], self._calculate_confidence([], len(text))
+        
+        # 強調語付きの語は元のキーワードも必ずヒットしているため、元のキーワードだけを見ればよい
+        hit_categories = {
+            category_id
+            for word in found_words
+            for category_id in self._keyword_categories.get(word, ())
+        }
         
-        # 2. カテゴリ別の分析
+        # 2. カテゴリ別の分析（ヒットしたカテゴリのみ）
         categories_result = []
         total_score = 0.0
         max_score = 0.0
         
         for category_id, category_data in self.categories.items():
+            if category_id not in hit_categories:
+                continue
             score, found_keywords = self._analyze_category(
-                normalized_text, 
+                found_words, 
                 category_data
             )
             
@@ -90,47 +153,47 @@ class KeywordAnalyzer:
     def _normalize_text(self, text: str) -> str:
         """テキストの正規化"""
         text = text.lower()
-        text = re.sub(r'\s+', ' ', text)
-        text = text.translate(str.maketrans(
-            'ＡＢＣＤＥＦＧＨＩＪＫＬＭＮＯＰＱＲＳＴＵＶＷＸＹＺａｂｃｄｅｆｇｈｉｊｋｌｍｎｏｐｑｒｓｔｕｖｗｘｙｚ０１２３４５６７８９',
-            'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789'
-        ))
-        return text
+        text = _WHITESPACE_RE.sub(' ', text)
+        return text.translate(_FULLWIDTH_TABLE)
     
-    def _analyze_category(self, text: str, category_data: Dict) -> Tuple[float, List[str]]:
-        """カテゴリ別の分析"""
+    def _analyze_category(self, found_words: set, category_data: Dict) -> Tuple[float, List[str]]:
+        """カテゴリ別の分析（found_words: テキスト中に見つかったキーワードの集合）"""
         keywords = category_data["keywords"]
-        found_keywords = []
+        # 重複は追加時に除く（検出順を保つ）
+        found_keywords: List[str] = []
+        seen = set()
         
         for keyword in keywords:
-            if keyword in text:
+            if keyword in found_words and keyword not in seen:
+                seen.add(keyword)
                 found_keywords.append(keyword)
                 
                 for intensifier in self.modifiers["intensifiers"]:
-                    if f"{intensifier}{keyword}" in text:
-                        found_keywords.append(f"{intensifier}{keyword}")
+                    intensified = f"{intensifier}{keyword}"
+                    if intensified in found_words and intensified not in seen:
+                        seen.add(intensified)
+                        found_keywords.append(intensified)
         
         if found_keywords:
-            unique_keywords = list(set(found_keywords))
             weight = category_data.get("weight", 0.5)
             
             # カテゴリの重要度に応じてスコアを調整
             if weight >= 1.0:  # 重度の毒性
-                if len(unique_keywords) == 1:
+                if len(found_keywords) == 1:
                     score = 0.8
                 else:
                     score = 1.0
             elif weight >= 0.8:  # 中程度の毒性
-                if len(unique_keywords) == 1:
+                if len(found_keywords) == 1:
                     score = 0.6
-                elif len(unique_keywords) == 2:
+                elif len(found_keywords) == 2:
                     score = 0.8
                 else:
                     score = 1.0
             else:  # 軽度の毒性
-                if len(unique_keywords) == 1:
+                if len(found_keywords) == 1:
                     score = 0.4
-                elif len(unique_keywords) == 2:
+                elif len(found_keywords) == 2:
                     score = 0.6
                 else:
                     score = 0.8
@@ -8,8 +8,8 @@ from asyncio import TimeoutError
 from typing import Dict, List, Optional, Literal, Tuple
 from dataclasses import dataclass
 import logging
+import math
 import time
-import numpy as np
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # 各アナライザーをインポート
@@ -39,10 +39,12 @@ except ImportError:
         print(f"Pythonパス: {sys.path}")
         raise
 
-# ログ設定
-logging.basicConfig(level=logging.INFO)
+# ログ設定（出力レベル・形式はmain.pyで設定）
 logger = logging.getLogger(__name__)
 
+# 一括分析（prefetch_batch）での外部APIの同時呼び出し数
+PREFETCH_CONCURRENCY = 8
+
 
 @dataclass
 class ModelResult:
@@ -114,6 +116,15 @@ class MultiModelAnalyzer:
             'claude': MODEL_CONFIGS['claude'].timeout if 'claude' in MODEL_CONFIGS else 10,
             'openai': MODEL_CONFIGS['openai'].timeout if 'openai' in MODEL_CONFIGS else 10,
         }
+        
+        # 初期化できたモデルごとの（重み, タイムアウト）をまとめて保持し、リクエストごとの参照を1回にする
+        self._model_conf = {
+            name: (self.model_weights.get(name, 0.1), self.timeouts.get(name, 5))
+            for name in self.models
+        }
+        
+        # 非同期版を持たないモデル用のスレッドプール（既定のスレッドプールと共有せず上限を設ける）
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="multi-model")
     
     async def analyze_with_model(self, model_name: str, text: str) -> ModelResult:
         """単一モデルで分析を実行"""
@@ -128,17 +139,23 @@ class MultiModelAnalyzer:
                 error=f"Model {model_name} not available"
             )
         
-        start_time = time.time()
+        # タイムアウト時のログでも同じ値を使う
+        _, timeout = self._model_conf[model_name]
+        start_time = time.perf_counter()
         try:
-            # タイムアウト付きで実行
-            timeout = self.timeouts.get(model_name, 5)
-            
             # 非同期実行のラッパー
             async def run_analysis():
                 model = self.models[model_name]
-                # analyzeメソッドを非同期で実行
-                loop = asyncio.get_event_loop()
-                return await loop.run_in_executor(None, model.analyze, text)
+                if model_name == "keyword":
+                    # キーワード照合は1回の走査で終わるため、スレッドを介さずその場で実行
+                    return model.analyze(text)
+                if hasattr(model, "analyze_async"):
+                    # 非同期版を持つモデルはイベントループ上で待機
+                    # （外部APIはスレッドを占有せず、埋め込みモデルは同時リクエストをまとめてエンコード）
+                    return await model.analyze_async(text)
+                # その他のモデルは専用のスレッドプールで実行
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._executor, model.analyze, text)
             
             # タイムアウト付きで実行
             score, categories, confidence = await asyncio.wait_for(
@@ -146,7 +163,7 @@ class MultiModelAnalyzer:
                 timeout=timeout
             )
             
-            response_time = time.time() - start_time
+            response_time = time.perf_counter() - start_time
             
             return ModelResult(
                 model_name=model_name,
@@ -158,14 +175,14 @@ class MultiModelAnalyzer:
             )
             
         except asyncio.TimeoutError:
-            logger.warning(f"{model_name}がタイムアウト（{self.timeouts[model_name]}秒）")
+            logger.warning(f"{model_name}がタイムアウト（{timeout}秒）")
             return ModelResult(
                 model_name=model_name,
                 toxicity_score=0.0,
                 is_toxic=False,
                 categories=[],
                 confidence=0.0,
-                response_time=time.time() - start_time,
+                response_time=time.perf_counter() - start_time,
                 error="Timeout"
             )
         except Exception as e:
@@ -176,7 +193,7 @@ class MultiModelAnalyzer:
                 is_toxic=False,
                 categories=[],
                 confidence=0.0,
-                response_time=time.time() - start_time,
+                response_time=time.perf_counter() - start_time,
                 error=str(e)
             )
     
@@ -187,7 +204,7 @@ class MultiModelAnalyzer:
     ) -> Dict:
         """戦略に基づいて分析を実行"""
         
-        start_time = time.time()
+        start_time = time.perf_counter()
         results = []
         
         if strategy == "fast":
@@ -201,57 +218,52 @@ class MultiModelAnalyzer:
             results.append(keyword_result)
             
             # キーワードで中間的なスコアの場合、追加分析
+            follow_up_models = []
             if 0.2 <= keyword_result.toxicity_score <= 0.7:
                 if "toxic_bert" in self.models:
-                    bert_result = await self.analyze_with_model("toxic_bert", text)
-                    results.append(bert_result)
+                    follow_up_models.append("toxic_bert")
                     
                 # さらに高精度が必要な場合、Claude追加
                 if 0.3 <= keyword_result.toxicity_score <= 0.6 and "claude" in self.models:
-                    claude_result = await self.analyze_with_model("claude", text)
-                    results.append(claude_result)
+                    follow_up_models.append("claude")
+            
+            # 追加するモデルはどちらもキーワードの結果だけで決まるため並列に実行
+            results.extend(await self._run_models(follow_up_models, text))
         
         elif strategy == "balanced":
             # バランス型：利用可能な全モデルを並列実行
-            tasks = []
-            for model_name in self.models.keys():
-                task = asyncio.create_task(self.analyze_with_model(model_name, text))
-                tasks.append((model_name, task))
-            
-            # 全タスクの完了を待つ
-            for model_name, task in tasks:
-                try:
-                    result = await task
-                    results.append(result)
-                except Exception as e:
-                    logger.error(f"{model_name}の実行エラー: {e}")
+            results.extend(await self._run_models(list(self.models.keys()), text))
         
         elif strategy == "accurate":
             # 高精度：重要なモデルに重点
             priority_models = ["keyword", "toxic_bert", "claude"]
-            tasks = []
-            
-            for model_name in priority_models:
-                if model_name in self.models:
-                    task = asyncio.create_task(self.analyze_with_model(model_name, text))
-                    tasks.append((model_name, task))
-            
-            # 全タスクの完了を待つ
-            for model_name, task in tasks:
-                try:
-                    result = await task
-                    results.append(result)
-                except Exception as e:
-                    logger.error(f"{model_name}の実行エラー: {e}")
+            results.extend(await self._run_models(
+                [model_name for model_name in priority_models if model_name in self.models],
+                text
+            ))
         
         # 結果の統合
         final_result = self._aggregate_results(results, strategy)
-        final_result["analysis_time"] = time.time() - start_time
+        final_result["analysis_time"] = time.perf_counter() - start_time
         final_result["strategy"] = strategy
         final_result["models_used"] = [r.model_name for r in results if r.error is None]
         
         return final_result
     
+    async def _run_models(self, model_names: List[str], text: str) -> List[ModelResult]:
+        """複数モデルを並列に実行（例外になったモデルは結果から除く）"""
+        outcomes = await asyncio.gather(
+            *(self.analyze_with_model(model_name, text) for model_name in model_names),
+            return_exceptions=True
+        )
+        results = []
+        for model_name, outcome in zip(model_names, outcomes):
+            if isinstance(outcome, Exception):
+                logger.error(f"{model_name}の実行エラー: {outcome}")
+            else:
+                results.append(outcome)
+        return results
+    
     def _aggregate_results(self, results: List[ModelResult], strategy: str) -> Dict:
         """複数モデルの結果を統合"""
         if not results:
@@ -277,32 +289,28 @@ class MultiModelAnalyzer:
                 "details": {"error": "All models failed"}
             }
         
-        # 重み付き平均の計算
+        # 重み付き平均・信頼度・カテゴリの統合（重複を除く）を1回の走査で計算
         total_weight = 0
         weighted_score = 0
-        all_categories = []
-        confidence_scores = []
+        total_confidence = 0.0
+        unique_categories = []
+        seen_names = set()
         
         for result in valid_results:
-            weight = self.model_weights.get(result.model_name, 0.1)
+            weight, _ = self._model_conf.get(result.model_name, (0.1, 5))
             weighted_score += result.toxicity_score * weight
             total_weight += weight
-            all_categories.extend(result.categories)
-            confidence_scores.append(result.confidence)
+            total_confidence += result.confidence
+            for cat in result.categories:
+                if cat.name not in seen_names:
+                    unique_categories.append(cat)
+                    seen_names.add(cat.name)
         
         # 最終スコア
         final_score = weighted_score / total_weight if total_weight > 0 else 0.0
         
-        # カテゴリの統合（重複を除く）
-        unique_categories = []
-        seen_names = set()
-        for cat in all_categories:
-            if cat.name not in seen_names:
-                unique_categories.append(cat)
-                seen_names.add(cat.name)
-        
         # 信頼度の計算
-        avg_confidence = np.mean(confidence_scores) if confidence_scores else 0.0
+        avg_confidence = total_confidence / len(valid_results)
         
         # 各モデルの詳細結果
         model_details = {}
@@ -329,6 +337,65 @@ class MultiModelAnalyzer:
             }
         }
     
+    async def prefetch_batch(
+        self,
+        texts: List[str],
+        strategy: Literal["fast", "cascade", "balanced", "accurate"] = "balanced"
+    ) -> None:
+        """
+        バッチ分析の前に全テキストを対象となるモデルでまとめて実行し、キャッシュに載せる
+        （以降のテキストごとの分析はキャッシュヒットになる）
+        
+        - toxic_bert: 全テキストを1回のエンコードで処理
+        - claude: 重複を除いたテキストを同時実行数を制限して並列に呼び出す
+        - openai: 複数テキストを1回のAPI呼び出しにまとめる（balancedのみ使用）
+        
+        外部APIはモデルのタイムアウト×同時実行の段数で打ち切る。
+        打ち切られたテキストは、以降のテキストごとの分析（モデルごとのタイムアウトあり）で処理される
+        """
+        # 全テキストを必ず各モデルで分析する戦略のみ（cascadeはスコア次第で呼ばないため除外）
+        if strategy not in ("balanced", "accurate"):
+            return
+        
+        jobs = {}
+        if "toxic_bert" in self.models:
+            jobs["toxic_bert"] = self.models["toxic_bert"].analyze_batch_async(texts)
+        if "claude" in self.models:
+            jobs["claude"] = asyncio.wait_for(
+                self.models["claude"].analyze_many(texts, concurrency=PREFETCH_CONCURRENCY),
+                self._prefetch_timeout("claude", len(texts), PREFETCH_CONCURRENCY)
+            )
+        if "openai" in self.models and strategy == "balanced":
+            from app.services.openai_analyzer import BATCH_PROMPT_SIZE
+            # BATCH_PROMPT_SIZE件ごとに1回の呼び出し（応答が不正なチャンクの1件ずつの再分析も制限時間に含める）
+            jobs["openai"] = asyncio.wait_for(
+                self.models["openai"].analyze_many(texts, concurrency=PREFETCH_CONCURRENCY),
+                self._prefetch_timeout(
+                    "openai", math.ceil(len(texts) / BATCH_PROMPT_SIZE), PREFETCH_CONCURRENCY
+                )
+            )
+        
+        results = await asyncio.gather(*jobs.values(), return_exceptions=True)
+        for model_name, result in zip(jobs, results):
+            if isinstance(result, TimeoutError):
+                logger.warning(f"{model_name}の一括分析がタイムアウトしました（残りはテキストごとに分析）")
+            elif isinstance(result, Exception):
+                logger.warning(f"{model_name}の一括分析エラー: {result}")
+    
+    def _prefetch_timeout(self, model_name: str, calls: int, concurrency: int) -> float:
+        """一括分析の制限時間：API呼び出しcalls回を同時concurrency件で実行した場合の段数×モデルのタイムアウト"""
+        return self._model_conf[model_name][1] * max(1, math.ceil(calls / concurrency))
+    
+    async def aclose(self) -> None:
+        """外部APIクライアントの接続・各モデルのスレッドを閉じる"""
+        for model_name, model in self.models.items():
+            if hasattr(model, "aclose"):
+                try:
+                    await model.aclose()
+                except Exception as e:
+                    logger.warning(f"{model_name}の終了処理エラー: {e}")
+        self._executor.shutdown(wait=False, cancel_futures=True)
+    
     def get_available_models(self) -> List[str]:
         """利用可能なモデルのリストを返す"""
         return list(self.models.keys())
@@ -348,6 +415,8 @@ class MultiModelAnalyzer:
 
 # テストコード
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    
     async def test():
         print("=== マルチモデル統合テスト（Release 4） ===")
         analyzer = MultiModelAnalyzer()
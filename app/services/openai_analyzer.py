@@ -4,26 +4,46 @@ GPT-4o-miniまたはGPT-3.5-turboを使用して高精度な日本語毒性判
 """
 
 import os
+import re
 import json
 import time
 import asyncio
+import unicodedata
 from typing import Dict, List, Tuple, Optional
 from datetime import datetime
+import httpx
 import openai
-from openai import OpenAI
+import orjson
+from openai import OpenAI, AsyncOpenAI
 from dotenv import load_dotenv
-import concurrent.futures
 import logging
 
+try:
+    import h2  # HTTP/2（httpx[http2]）
+except ImportError:
+    h2 = None
+
 # ロガーの設定
 logger = logging.getLogger(__name__)
 
 # スキーマのインポート
+from app.config import settings, API_SPECIFIC_CONFIG
 from app.models.schemas import ToxicityCategory
+from app.services.result_cache import ResultCache
+from app.services.circuit_breaker import CircuitBreaker, CircuitOpenError
 
 # 環境変数の読み込み
 load_dotenv()
 
+# 一括分析で1回のAPI呼び出しにまとめるテキスト数
+BATCH_PROMPT_SIZE = 8
+
+# 空白の連続（正規化用）
+_WHITESPACE_RE = re.compile(r'\s+')
+
+# 上流の障害とみなすエラー（接続エラー・タイムアウト・429・5xx）
+_UPSTREAM_ERRORS = (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+
 
 class OpenAIAnalyzer:
     """OpenAI APIを使用した毒性分析クラス"""
@@ -35,15 +55,45 @@ class OpenAIAnalyzer:
         if not api_key:
             raise ValueError("OPENAI_API_KEY environment variable is not set")
         
-        # OpenAIクライアントの初期化
-        self.client = OpenAI(api_key=api_key)
+        openai_config = API_SPECIFIC_CONFIG.get("openai", {})
+        
+        # OpenAIクライアントの初期化（同期版はanalyze()用、非同期版はanalyze_text()用）
+        # 429/5xxはSDKがRetry-Afterを優先しつつジッター付き指数バックオフで再試行する
+        client_options = {
+            "api_key": api_key,
+            "timeout": settings.EXTERNAL_API_TIMEOUT,
+            "max_retries": openai_config.get("max_retries", 3)
+        }
+        self.client = OpenAI(**client_options)
+        
+        # 非同期クライアントはプロセス内で1つの接続プールを使い回す
+        # （h2が導入されていればHTTP/2で同時リクエストを1本のTLS接続に多重化する）
+        max_connections = openai_config.get("max_connections", 64)
+        self.aclient = AsyncOpenAI(
+            **client_options,
+            http_client=httpx.AsyncClient(
+                http2=h2 is not None,
+                limits=httpx.Limits(
+                    max_connections=max_connections,
+                    max_keepalive_connections=max_connections // 2
+                ),
+                timeout=settings.EXTERNAL_API_TIMEOUT
+            )
+        )
+        
+        # 連続エラー時は一定時間APIを呼ばずにフォールバック結果を返す
+        self._breaker = CircuitBreaker(
+            "OpenAI API",
+            failure_threshold=openai_config.get("circuit_failure_threshold", 5),
+            reset_timeout=openai_config.get("circuit_reset_timeout", 30.0)
+        )
         
         # モデル設定（コスト効率を考慮してgpt-4o-miniを使用）
         self.model = "gpt-4o-mini"  # または "gpt-3.5-turbo"
         
-        # キャッシュの初期化
-        self.cache = {}
+        # キャッシュの初期化（Redisが設定されていれば全ワーカーで共有し、再起動後も再利用）
         self.max_cache_size = 100
+        self.cache = ResultCache(maxsize=self.max_cache_size, namespace="openai")
         
         # カテゴリ定義
         self.categories = {
@@ -98,127 +148,257 @@ class OpenAIAnalyzer:
         Returns:
             分析結果の辞書
         """
-        start_time = time.time()
+        start_time = time.perf_counter()
+        text = self._normalize(text)
         
         # キャッシュチェック
-        if text in self.cache:
-            cached_result = self.cache[text].copy()
-            cached_result['cache_hit'] = True
-            cached_result['processing_time'] = 0.001
-            return cached_result
+        cached_result = await self.cache.aget(text)
+        if cached_result is not None:
+            return self._mark_cached(cached_result)
         
         try:
-            # OpenAI APIを呼び出し
-            response = await asyncio.to_thread(
-                self.client.chat.completions.create,
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": self.system_prompt},
-                    {"role": "user", "content": f"以下のテキストの毒性を分析してください:\n\n{text}"}
-                ],
-                temperature=0.1,  # 一貫性のため低めに設定
-                max_tokens=500,
-                response_format={"type": "json_object"}
-            )
-            
-            # レスポンスの解析
-            result_text = response.choices[0].message.content
-            result_data = json.loads(result_text)
-            
-            # 結果の構造化
-            categories = []
-            for cat_data in result_data.get('categories', []):
-                if cat_data.get('detected', False):
-                    category = ToxicityCategory(
-                        name=cat_data['name'],
-                        score=cat_data.get('score', 0.0),
-                        keywords_found=cat_data.get('keywords', [])
-                    )
-                    categories.append({
-                        'name': category.name,
-                        'score': category.score,
-                        'keywords_found': category.keywords_found
-                    })
+            # OpenAI APIを非同期に呼び出し（スレッドを使わずイベントループ上で待機）
+            content = await self._create_async(self._request_params(text))
+            result = self._build_result(content, start_time)
+        except Exception as e:
+            return self._error_result(e, start_time)
+        
+        # キャッシュに保存
+        await self.cache.aput(text, result)
+        return result
+    
+    async def analyze_many(self, texts: List[str], concurrency: int = 4) -> List[Dict]:
+        """
+        複数テキストをまとめて分析（キャッシュにないテキストをBATCH_PROMPT_SIZE件ずつ1回のAPI呼び出しで分析）
+        システムプロンプトと往復の待ち時間を複数テキストで共有する
+        
+        Args:
+            texts: 分析対象のテキストリスト
+            concurrency: API同時呼び出し数の上限
             
-            # 最終結果の構築
-            result = {
-                'score': result_data.get('toxicity_score', 0.0),
-                'is_toxic': result_data.get('is_toxic', False),
-                'confidence': result_data.get('confidence', 0.5),
-                'categories': categories,
-                'model': self.model,
-                'reasoning': result_data.get('reasoning', ''),
-                'processing_time': time.time() - start_time,
-                'cache_hit': False,
-                'timestamp': datetime.now().isoformat()
+        Returns:
+            textsと同じ順序の分析結果リスト
+        """
+        start_time = time.perf_counter()
+        normalized = [self._normalize(text) for text in texts]
+        results = {}
+        misses = []
+        for text in dict.fromkeys(normalized):
+            cached_result = await self.cache.aget(text)
+            if cached_result is not None:
+                results[text] = self._mark_cached(cached_result)
+            else:
+                misses.append(text)
+        
+        sem = asyncio.Semaphore(concurrency)
+        
+        async def analyze_chunk(chunk: List[str]) -> Dict[str, Dict]:
+            async with sem:
+                return await self._analyze_chunk(chunk, start_time)
+        
+        chunks = [misses[i:i + BATCH_PROMPT_SIZE] for i in range(0, len(misses), BATCH_PROMPT_SIZE)]
+        for chunk_results in await asyncio.gather(*(analyze_chunk(chunk) for chunk in chunks)):
+            results.update(chunk_results)
+        
+        return [results[text].copy() for text in normalized]
+    
+    async def _analyze_chunk(self, texts: List[str], start_time: float) -> Dict[str, Dict]:
+        """複数テキストを1回のAPI呼び出しで分析（応答が不正な場合は1件ずつ分析し直す）"""
+        if len(texts) == 1:
+            return {texts[0]: await self.analyze_text(texts[0])}
+        
+        try:
+            content = await self._create_async(self._batch_request_params(texts))
+            items = orjson.loads(content).get('results', [])
+            by_index = {item.get('index'): item for item in items if isinstance(item, dict)}
+            if any(i not in by_index for i in range(1, len(texts) + 1)):
+                raise ValueError(f"結果が不足しています（{len(by_index)}/{len(texts)}件）")
+            results = {
+                text: self._result_from_data(by_index[i], start_time)
+                for i, text in enumerate(texts, 1)
             }
-            
-            # キャッシュに保存
-            if len(self.cache) >= self.max_cache_size:
-                # 最も古いエントリを削除
-                oldest_key = min(self.cache.keys(), 
-                               key=lambda k: self.cache[k].get('timestamp', ''))
-                del self.cache[oldest_key]
-            
-            self.cache[text] = result.copy()
-            
-            return result
-            
         except Exception as e:
-            print(f"OpenAI API error: {str(e)}")
-            # エラー時のフォールバック
-            return {
-                'score': 0.0,
-                'is_toxic': False,
-                'confidence': 0.0,
-                'categories': [],
-                'model': self.model,
-                'error': str(e),
-                'processing_time': time.time() - start_time,
-                'cache_hit': False,
-                'timestamp': datetime.now().isoformat()
-            }
+            logger.warning(f"OpenAI一括分析に失敗したため1件ずつ分析します（{len(texts)}件）: {e}")
+            outcomes = await asyncio.gather(*(self.analyze_text(text) for text in texts))
+            return dict(zip(texts, outcomes))
+        
+        for text, result in results.items():
+            await self.cache.aput(text, result)
+        return results
     
-    def analyze(self, text: str) -> Tuple[float, List[ToxicityCategory], float]:
-        """同期版の分析メソッド（MultiModelAnalyzer互換）"""
+    async def aclose(self) -> None:
+        """非同期クライアントの接続プールを閉じる（終了時にlifespanから呼ぶ）"""
+        await self.aclient.close()
+    
+    def _analyze_sync(self, text: str) -> Dict:
+        """テキストの毒性を分析（同期版。呼び出し元のスレッドでAPIを呼ぶ）"""
+        start_time = time.perf_counter()
+        text = self._normalize(text)
+        
+        cached_result = self.cache.get(text)
+        if cached_result is not None:
+            return self._mark_cached(cached_result)
+        
         try:
-            # 既存のイベントループをチェック
-            try:
-                loop = asyncio.get_running_loop()
-                # イベントループが実行中の場合、別スレッドで実行
-                import concurrent.futures
-                with concurrent.futures.ThreadPoolExecutor() as executor:
-                    future = executor.submit(asyncio.run, self.analyze_text(text))
-                    result = future.result()
-            except RuntimeError:
-                # イベントループが実行中でない場合
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                try:
-                    result = loop.run_until_complete(self.analyze_text(text))
-                finally:
-                    loop.close()
-            
-            # 結果の変換
-            score = result.get('score', 0.0)
-            confidence = result.get('confidence', 0.5)
-            
-            # カテゴリを変換
-            categories = []
-            for cat_detail in result.get('categories_detail', []):
+            content = self._create(self._request_params(text))
+            result = self._build_result(content, start_time)
+        except Exception as e:
+            return self._error_result(e, start_time)
+        
+        self.cache.put(text, result)
+        return result
+    
+    async def _create_async(self, params: Dict) -> str:
+        """サーキットブレーカーを通してAPIを呼び出し、応答本文を返す（非同期版）"""
+        if not self._breaker.allow():
+            raise CircuitOpenError("OpenAI APIは連続エラーのため一時停止中です")
+        try:
+            response = await self.aclient.chat.completions.create(**params)
+        except _UPSTREAM_ERRORS:
+            self._breaker.on_failure()
+            raise
+        self._breaker.on_success()
+        return response.choices[0].message.content
+    
+    def _create(self, params: Dict) -> str:
+        """サーキットブレーカーを通してAPIを呼び出し、応答本文を返す（同期版）"""
+        if not self._breaker.allow():
+            raise CircuitOpenError("OpenAI APIは連続エラーのため一時停止中です")
+        try:
+            response = self.client.chat.completions.create(**params)
+        except _UPSTREAM_ERRORS:
+            self._breaker.on_failure()
+            raise
+        self._breaker.on_success()
+        return response.choices[0].message.content
+    
+    def _normalize(self, text: str) -> str:
+        """全角・半角の表記ゆれと空白をまとめる（キャッシュキーとプロンプトの両方に使用）"""
+        return _WHITESPACE_RE.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+    
+    def _mark_cached(self, cached_result: Dict) -> Dict:
+        """キャッシュから取得した結果に印を付ける"""
+        cached_result['cache_hit'] = True
+        cached_result['processing_time'] = 0.001
+        return cached_result
+    
+    def _request_params(self, text: str) -> Dict:
+        """chat.completions.createに渡すパラメータ（同期・非同期で共通）"""
+        return {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": self.system_prompt},
+                {"role": "user", "content": f"以下のテキストの毒性を分析してください:\n\n{text}"}
+            ],
+            "temperature": 0.1,  # 一貫性のため低めに設定
+            "max_tokens": 500,
+            "response_format": {"type": "json_object"}
+        }
+    
+    def _batch_request_params(self, texts: List[str]) -> Dict:
+        """複数テキストを番号付きで1つのユーザーメッセージにまとめる（システムプロンプトは単発と共通）"""
+        numbered = "\n\n".join(f"[{i}]\n{text}" for i, text in enumerate(texts, 1))
+        return {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": self.system_prompt},
+                {"role": "user", "content": (
+                    f"以下の{len(texts)}件のテキストの毒性をそれぞれ独立に分析してください。\n"
+                    '各テキストの結果を上記の形式で作成し、"index"に番号を加えて'
+                    '{"results": [...]}の形で番号順に返してください:\n\n'
+                    f"{numbered}"
+                )}
+            ],
+            "temperature": 0.1,
+            "max_tokens": 500 * len(texts),
+            "response_format": {"type": "json_object"}
+        }
+    
+    def _build_result(self, result_text: str, start_time: float) -> Dict:
+        """APIのJSONレスポンスから分析結果を構築"""
+        return self._result_from_data(orjson.loads(result_text), start_time)
+    
+    def _result_from_data(self, result_data: Dict, start_time: float) -> Dict:
+        """1テキスト分の判定（JSONオブジェクト）から分析結果を構築"""
+        # 結果の構造化
+        categories = []
+        for cat_data in result_data.get('categories', []):
+            if cat_data.get('detected', False):
                 category = ToxicityCategory(
-                    name=cat_detail['name'],
-                    score=cat_detail['score'],
-                    keywords_found=cat_detail.get('keywords', [])
+                    name=cat_data['name'],
+                    score=cat_data.get('score', 0.0),
+                    keywords_found=cat_data.get('keywords', [])
                 )
-                categories.append(category)
-            
-            return score, categories, confidence
-            
+                categories.append({
+                    'name': category.name,
+                    'score': category.score,
+                    'keywords_found': category.keywords_found
+                })
+        
+        # 最終結果の構築
+        return {
+            'score': result_data.get('toxicity_score', 0.0),
+            'is_toxic': result_data.get('is_toxic', False),
+            'confidence': result_data.get('confidence', 0.5),
+            'categories': categories,
+            'model': self.model,
+            'reasoning': result_data.get('reasoning', ''),
+            'processing_time': time.perf_counter() - start_time,
+            'cache_hit': False,
+            'timestamp': datetime.now().isoformat()
+        }
+    
+    def _error_result(self, error: Exception, start_time: float) -> Dict:
+        """エラー時のフォールバック結果"""
+        # 停止中は毎回ログを出さない（停止・再開時にCircuitBreakerが記録する）
+        if not isinstance(error, CircuitOpenError):
+            logger.error(f"OpenAI API error: {str(error)}")
+        return {
+            'score': 0.0,
+            'is_toxic': False,
+            'confidence': 0.0,
+            'categories': [],
+            'model': self.model,
+            'error': str(error),
+            'processing_time': time.perf_counter() - start_time,
+            'cache_hit': False,
+            'timestamp': datetime.now().isoformat()
+        }
+    
+    def analyze(self, text: str) -> Tuple[float, List[ToxicityCategory], float]:
+        """同期版の分析メソッド（MultiModelAnalyzer互換）"""
+        try:
+            # 同期クライアントを直接呼び出す（イベントループを生成しない）
+            return self._to_tuple(self._analyze_sync(text))
+        except Exception as e:
+            logger.error(f"OpenAI分析エラー: {str(e)}")
+            return 0.0, [], 0.0
+    
+    async def analyze_async(self, text: str) -> Tuple[float, List[ToxicityCategory], float]:
+        """analyzeの非同期版（スレッドを使わずイベントループ上でAPIを待機）"""
+        try:
+            return self._to_tuple(await self.analyze_text(text))
         except Exception as e:
             logger.error(f"OpenAI分析エラー: {str(e)}")
             return 0.0, [], 0.0
     
+    def _to_tuple(self, result: Dict) -> Tuple[float, List[ToxicityCategory], float]:
+        """分析結果の辞書をMultiModelAnalyzer互換の（スコア, カテゴリ, 信頼度）に変換"""
+        score = result.get('score', 0.0)
+        confidence = result.get('confidence', 0.5)
+        
+        # カテゴリを変換
+        categories = []
+        for cat_detail in result.get('categories', []):
+            category = ToxicityCategory(
+                name=cat_detail['name'],
+                score=cat_detail['score'],
+                keywords_found=cat_detail.get('keywords_found', [])
+            )
+            categories.append(category)
+        
+        return score, categories, confidence
+    
     def get_model_info(self) -> Dict:
         """モデル情報を取得"""
         return {
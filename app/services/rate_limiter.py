@@ -0,0 +1,56 @@
+"""
+外部APIの適応型レート制限
+トークンバケットで呼び出し間隔を空け、レート制限エラーで速度を下げ、成功が続けば上限まで戻す
+"""
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveRateLimiter:
+    """
+    適応型トークンバケット（AIMD）
+
+    - 成功するたびに毎秒の呼び出し数をincreaseずつ増やす（max_rateまで）
+    - レート制限エラーで毎秒の呼び出し数をdecrease倍に下げ、溜まっていたトークンを捨てる（min_rateまで）
+    """
+
+    def __init__(self, max_rate: float, min_rate: float = 0.5, increase: float = 0.5, decrease: float = 0.5):
+        self.max_rate = max_rate
+        self.min_rate = min(min_rate, max_rate)
+        self.increase = increase
+        self.decrease = decrease
+        self.rate = max_rate
+        self._tokens = 1.0
+        self._updated_at = time.monotonic()
+        # 待機中の呼び出しを到着順に1つずつ通す
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        """経過時間に応じてトークンを補充（バースト上限は1秒分）"""
+        now = time.monotonic()
+        self._tokens = min(max(1.0, self.rate), self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self) -> None:
+        """トークンが溜まるまで待機して1つ消費する"""
+        async with self._lock:
+            self._refill()
+            if self._tokens < 1.0:
+                await asyncio.sleep((1.0 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1.0
+
+    def on_success(self) -> None:
+        """呼び出し成功：速度を少しずつ上限まで戻す"""
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_rate_limited(self) -> None:
+        """レート制限エラー：速度を下げる"""
+        self._refill()
+        self.rate = max(self.min_rate, self.rate * self.decrease)
+        self._tokens = 0.0
+        logger.warning(f"レート制限を検知したため呼び出し速度を下げます: {self.rate:.2f}回/秒")
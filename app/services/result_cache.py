@@ -0,0 +1,90 @@
+"""
+分析結果のLRUキャッシュ
+各アナライザーで共有する、スレッドセーフで命中率を集計できるキャッシュ
+namespaceを指定するとRedisを2段目に使い、ワーカー間で結果を共有する
+"""
+import hashlib
+import threading
+from typing import Dict, Optional
+
+from cachetools import LRUCache
+
+from app import cache
+
+# Redisに共有する結果の有効期限（秒）
+SHARED_CACHE_TTL = 24 * 60 * 60
+
+
+class ResultCache:
+    """テキスト→分析結果（dict）のLRUキャッシュ（取得・保存はコピーで行う）"""
+
+    def __init__(self, maxsize: int = 100, namespace: Optional[str] = None, ttl: int = SHARED_CACHE_TTL):
+        self.maxsize = maxsize
+        self.namespace = namespace
+        self.ttl = ttl
+        self._cache = LRUCache(maxsize=maxsize)
+        # run_in_executor経由で複数スレッドから参照されるためロックで保護
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, text: str) -> Optional[Dict]:
+        """キャッシュ済みの結果のコピーを返す（なければNone）"""
+        with self._lock:
+            result = self._cache.get(text)
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return result.copy()
+
+    def put(self, text: str, result: Dict) -> None:
+        """結果を保存（上限を超えた場合は最も長く使われていないものを破棄）"""
+        with self._lock:
+            self._cache[text] = result.copy()
+
+    async def aget(self, text: str) -> Optional[Dict]:
+        """ワーカー内になければRedisを参照する（Redis未設定時はgetと同じ）"""
+        with self._lock:
+            result = self._cache.get(text)
+        
+        if result is None and self.namespace:
+            result = await cache.get_json(self._shared_key(text))
+            if result is not None:
+                with self._lock:
+                    self._cache[text] = result
+        
+        with self._lock:
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return result.copy()
+    
+    async def aput(self, text: str, result: Dict) -> None:
+        """ワーカー内とRedisの両方に保存"""
+        self.put(text, result)
+        if self.namespace:
+            await cache.set_json(self._shared_key(text), result, self.ttl)
+    
+    def _shared_key(self, text: str) -> str:
+        """Redisのキー（長いテキストでもキー長が一定になるようハッシュ化）"""
+        return f"{self.namespace}:{hashlib.sha1(text.encode()).hexdigest()}"
+    
+    def __contains__(self, text: str) -> bool:
+        return text in self._cache
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def get_stats(self) -> Dict:
+        """キャッシュの統計情報"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._cache),
+                "max_size": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / max(1, total)
+            }
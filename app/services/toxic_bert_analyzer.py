@@ -3,24 +3,75 @@ Sentence-Transformers を使用した毒性検知サービス
 埋め込みベースの類似度計算による日本語テキストの毒性判定
 """
 
+import os
 import json
+import re
 import time
+import platform
+import unicodedata
 import numpy as np
 import concurrent.futures
 from pathlib import Path
 from typing import Dict, List, Tuple, Optional
 from datetime import datetime
 import asyncio
+import contextlib
+import torch
 from sentence_transformers import SentenceTransformer
 import logging
 
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+try:
+    import onnxruntime
+    from sentence_transformers import export_dynamic_quantized_onnx_model, export_optimized_onnx_model
+except ImportError:
+    onnxruntime = None
+
 # スキーマのインポート
 from app.models.schemas import ToxicityCategory
+from app.services.result_cache import ResultCache
+from app.config import PERFORMANCE_CONFIG
 
-# ログ設定
-logging.basicConfig(level=logging.INFO)
+# ログ設定（出力レベル・形式はmain.pyで設定）
 logger = logging.getLogger(__name__)
 
+# ONNX変換済みモデルの保存先（初回起動時にエクスポートし、以降は再利用）
+ONNX_MODEL_DIR = Path(os.getenv("TOXIC_BERT_ONNX_DIR", Path.home() / ".cache" / "toxiguard" / "onnx"))
+
+# Hugging Faceモデルのダウンロード先（未設定時はHFの既定キャッシュ）
+MODEL_CACHE_DIR = os.getenv("TOXIC_BERT_CACHE_DIR") or None
+
+# グラフ最適化レベル（O2: CPU向けの演算融合まで）
+ONNX_OPTIMIZATION_LEVEL = "O2"
+
+# int8動的量子化の設定（CPUの命令セットに合わせる。VNNI対応CPUではavx512_vnniを指定可能）
+ONNX_QUANTIZATION_CONFIG = os.getenv(
+    "TOXIC_BERT_ONNX_QCONFIG",
+    "arm64" if platform.machine().lower() in ("arm64", "aarch64") else "avx2"
+)
+
+# 推論に使うCPUスレッド数（0: 全コア。複数ワーカーで起動する場合は「コア数÷ワーカー数」程度に抑える）
+NUM_THREADS = int(os.getenv("TOXIC_BERT_NUM_THREADS", "0"))
+
+# 同時に届いた単発リクエストをまとめてエンコードする待ち時間（秒）と最大件数
+MICRO_BATCH_WAIT = 0.005
+MICRO_BATCH_SIZE = 32
+
+# 空白の連続（正規化用）
+_WHITESPACE_RE = re.compile(r'\s+')
+
+# 読み込み済みモデル（モデル名→モデル）：インスタンスを作り直してもプロセス内で1回だけ読み込む
+_MODEL_CACHE: Dict[str, SentenceTransformer] = {}
+
 
 class ToxicBertAnalyzer:
     """Sentence-Transformersを使用した毒性分析クラス"""
@@ -31,7 +82,7 @@ class ToxicBertAnalyzer:
         self.model_name = "paraphrase-multilingual-MiniLM-L12-v2"
         
         try:
-            self.model = SentenceTransformer(self.model_name)
+            self.model = self._get_model()
             logger.info(f"モデル {self.model_name} を正常に初期化しました")
         except Exception as e:
             logger.error(f"モデル初期化エラー: {str(e)}")
@@ -69,49 +120,194 @@ class ToxicBertAnalyzer:
             }
         }
         
+        # キーワードフォールバック用のオートマトン（全パターンを1回の走査で検出）
+        self._pattern_automaton = self._build_pattern_automaton()
+        
         # パターンの埋め込みを事前計算
         self._precompute_embeddings()
         
         # キャッシュ
-        self._cache = {}
         self._max_cache_size = 100
+        self._cache = ResultCache(maxsize=self._max_cache_size)
         
         # 閾値設定
         self.similarity_threshold = 0.5  # 類似度の閾値
+        
+        # マイクロバッチ（エンコード待ちのテキストと結果のFuture）
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._batch_tasks = set()
+        
+        # エンコード専用スレッド（1本で直列に実行し、既定のスレッドプールを占有しない）
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="toxic-bert")
+    
+    def _get_model(self) -> SentenceTransformer:
+        """読み込み済みのモデルがあれば共有し、なければ読み込む（推論のみのためインスタンス間で共有可能）"""
+        model = _MODEL_CACHE.get(self.model_name)
+        if model is None:
+            model = _MODEL_CACHE[self.model_name] = self._load_model()
+        return model
+    
+    def _load_model(self) -> SentenceTransformer:
+        """埋め込みモデルを読み込む（ONNX Runtimeを優先し、使えない場合はPyTorch）"""
+        if NUM_THREADS > 0:
+            torch.set_num_threads(NUM_THREADS)
+        
+        # GPUはCUDAが使える場合のみ（使えなければCPU向けの設定で読み込む）
+        use_gpu = PERFORMANCE_CONFIG.get("use_gpu") and torch.cuda.is_available()
+        
+        use_onnx = PERFORMANCE_CONFIG.get("embedding_backend") == "onnx" and not use_gpu
+        if use_onnx and onnxruntime is not None:
+            try:
+                return self._load_onnx_model()
+            except Exception as e:
+                logger.warning(f"ONNXモデルの読み込みに失敗したためPyTorchで実行します: {e}")
+        
+        if use_gpu:
+            # GPUでは半精度で推論（重みの転送量と演算時間を半減）
+            model = self._from_hub(device="cuda").half()
+            logger.info("埋め込みモデルをGPU（FP16）で読み込みました")
+            return model
+        
+        model = self._from_hub()
+        
+        # CPU推論ではLinear層をint8に動的量子化（重みの読み込み量を削減）
+        if PERFORMANCE_CONFIG.get("quantize_embeddings"):
+            model = torch.quantization.quantize_dynamic(
+                model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+            logger.info("埋め込みモデルをint8に量子化しました")
+        
+        return model
+    
+    def _from_hub(self, **kwargs) -> SentenceTransformer:
+        """
+        ダウンロード済みのモデルをネットワークに接続せずに読み込む
+        （キャッシュにない初回のみHugging Face Hubから取得）
+        """
+        try:
+            return SentenceTransformer(
+                self.model_name, cache_folder=MODEL_CACHE_DIR, local_files_only=True, **kwargs
+            )
+        except Exception:
+            logger.info(f"モデル {self.model_name} をHugging Face Hubから取得します")
+            return SentenceTransformer(self.model_name, cache_folder=MODEL_CACHE_DIR, **kwargs)
+    
+    def _load_onnx_model(self) -> SentenceTransformer:
+        """
+        ONNXにエクスポートしたモデルを読み込む（変換は初回のみ）
+        quantize_embeddingsが有効ならint8に動的量子化したモデル、無効ならグラフ最適化したモデルを使う
+        """
+        model_dir = ONNX_MODEL_DIR / self.model_name
+        quantize = PERFORMANCE_CONFIG.get("quantize_embeddings")
+        variant = f"qint8_{ONNX_QUANTIZATION_CONFIG}" if quantize else ONNX_OPTIMIZATION_LEVEL
+        file_name = f"onnx/model_{variant}.onnx"
+        
+        # 複数ワーカーが同時に起動しても変換は1プロセスだけが行い、
+        # 他のワーカーは書き込み途中のファイルを読まずに完了を待つ
+        with self._export_lock(model_dir):
+            if not (model_dir / file_name).exists():
+                if (model_dir / "onnx" / "model.onnx").exists():
+                    exported = SentenceTransformer(str(model_dir), backend="onnx")
+                else:
+                    logger.info(f"埋め込みモデルをONNXにエクスポートします: {model_dir}")
+                    exported = self._from_hub(backend="onnx")
+                    exported.save(str(model_dir))
+                
+                if quantize:
+                    export_dynamic_quantized_onnx_model(exported, ONNX_QUANTIZATION_CONFIG, str(model_dir))
+                else:
+                    export_optimized_onnx_model(exported, ONNX_OPTIMIZATION_LEVEL, str(model_dir))
+        
+        model_kwargs = {"file_name": file_name}
+        if NUM_THREADS > 0:
+            session_options = onnxruntime.SessionOptions()
+            session_options.intra_op_num_threads = NUM_THREADS
+            model_kwargs["session_options"] = session_options
+        
+        model = SentenceTransformer(
+            str(model_dir),
+            backend="onnx",
+            model_kwargs=model_kwargs
+        )
+        logger.info(f"ONNX Runtimeで埋め込みモデルを読み込みました（{variant}）")
+        return model
+    
+    @staticmethod
+    @contextlib.contextmanager
+    def _export_lock(model_dir: Path):
+        """ONNX変換用のプロセス間ロック（fcntlがない環境ではロックしない）"""
+        model_dir.mkdir(parents=True, exist_ok=True)
+        if fcntl is None:
+            yield
+            return
+        with open(model_dir.parent / f"{model_dir.name}.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
     
     def _precompute_embeddings(self):
         """毒性パターンの埋め込みを事前計算"""
         if self.model is None:
             self.pattern_embeddings = {}
+            self.pattern_matrix = None
             return
             
         self.pattern_embeddings = {}
+        normalized = []
+        offset = 0
         
         for category, info in self.toxic_patterns.items():
             patterns = info["patterns"]
             if patterns:
-                # パターンの埋め込みを計算
-                embeddings = self.model.encode(patterns)
+                # パターンの埋め込みを計算（コサイン類似度用に正規化済みで受け取る）
+                embeddings = self.model.encode(patterns, normalize_embeddings=True)
                 self.pattern_embeddings[category] = {
                     "embeddings": embeddings,
+                    # 全パターン行列の中でこのカテゴリが占める行
+                    "rows": slice(offset, offset + len(patterns)),
                     "patterns": patterns,
                     "weight": info["weight"]
                 }
+                normalized.append(embeddings)
+                offset += len(patterns)
+        
+        # 全カテゴリのパターンを1つの行列にまとめ、類似度を1回の行列積で求める
+        self.pattern_matrix = np.vstack(normalized) if normalized else None
     
-    def _calculate_similarity(self, text_embedding: np.ndarray, 
-                            pattern_embeddings: np.ndarray) -> float:
-        """コサイン類似度を計算"""
-        # 正規化
-        text_norm = text_embedding / np.linalg.norm(text_embedding)
-        pattern_norms = pattern_embeddings / np.linalg.norm(
-            pattern_embeddings, axis=1, keepdims=True
-        )
+    def _calculate_similarities(self, text_embeddings: np.ndarray) -> np.ndarray:
+        """
+        テキスト埋め込み（正規化済みの行列）と全パターンとのコサイン類似度を計算
         
-        # コサイン類似度
-        similarities = np.dot(pattern_norms, text_norm)
+        Returns:
+            [テキスト数, パターン数] の類似度行列
+        """
+        return text_embeddings @ self.pattern_matrix.T
+    
+    def _build_pattern_automaton(self):
+        """全カテゴリのパターンからAho-Corasickオートマトンを構築（未インストール時はNone）"""
+        if ahocorasick is None:
+            return None
         
-        # 最大類似度を返す
-        return float(np.max(similarities))
+        automaton = ahocorasick.Automaton()
+        for info in self.toxic_patterns.values():
+            for pattern in info["patterns"]:
+                automaton.add_word(pattern, pattern)
+        automaton.make_automaton()
+        return automaton
+    
+    def _find_patterns(self, text: str) -> set:
+        """テキストに含まれるパターンを列挙"""
+        if self._pattern_automaton is None:
+            return {
+                pattern
+                for info in self.toxic_patterns.values()
+                for pattern in info["patterns"]
+                if pattern in text
+            }
+        return {pattern for _, pattern in self._pattern_automaton.iter(text)}
     
     def _keyword_fallback(self, text: str) -> Tuple[float, List[str], str]:
         """キーワードベースのフォールバック判定"""
@@ -119,9 +315,14 @@ class ToxicBertAnalyzer:
         detected_keywords = []
         detected_category = "none"
         
+        # テキストの走査は1回のみ（以降は検出済みパターンとの照合）
+        found_patterns = self._find_patterns(text)
+        if not found_patterns:
+            return max_score, detected_keywords, detected_category
+        
         for category, info in self.toxic_patterns.items():
             for pattern in info["patterns"]:
-                if pattern in text:
+                if pattern in found_patterns:
                     score = info["weight"]
                     if score > max_score:
                         max_score = score
@@ -130,121 +331,247 @@ class ToxicBertAnalyzer:
         
         return max_score, detected_keywords, detected_category
     
+    def _score_embedding(self, text: str, pattern_similarities: np.ndarray) -> Tuple[float, List[Dict]]:
+        """全パターンとの類似度（_calculate_similaritiesの1行）から毒性スコアとカテゴリを算出"""
+        max_score = 0.0
+        categories = []
+        
+        for category, data in self.pattern_embeddings.items():
+            similarities = pattern_similarities[data["rows"]]
+            max_pattern_idx = int(np.argmax(similarities))
+            similarity = float(similarities[max_pattern_idx])
+            
+            if similarity >= self.similarity_threshold:
+                # 類似度が閾値を超えた場合
+                category_score = similarity * data["weight"]
+                
+                categories.append({
+                    "name": category,
+                    "score": category_score,
+                    "keywords_found": [data["patterns"][max_pattern_idx]],
+                    "similarity": similarity
+                })
+                
+                if category_score > max_score:
+                    max_score = category_score
+        
+        # キーワードフォールバックも確認
+        keyword_score, keywords, _ = self._keyword_fallback(text)
+        if keyword_score > max_score:
+            max_score = keyword_score
+            # キーワードベースのカテゴリも追加
+            for category, info in self.toxic_patterns.items():
+                for keyword in keywords:
+                    if keyword in info["patterns"]:
+                        categories.append({
+                            "name": category,
+                            "score": info["weight"],
+                            "keywords_found": [keyword]
+                        })
+                        break
+        
+        return max_score, categories
+    
+    def _score_fallback(self, text: str) -> Tuple[float, List[Dict]]:
+        """モデルが利用できない場合のキーワードのみの判定"""
+        score, keywords, category = self._keyword_fallback(text)
+        categories = []
+        if score > 0:
+            categories.append({
+                "name": category,
+                "score": score,
+                "keywords_found": keywords
+            })
+        return score, categories
+    
+    def _build_result(
+        self, text: str, score: float, categories: List[Dict], start_time: float, timestamp: Optional[str] = None
+    ) -> Dict:
+        """分析結果を構築してキャッシュに保存（timestamp: バッチ内で共通の時刻。省略時は現在時刻）"""
+        result = {
+            "score": score,
+            "is_toxic": score >= 0.3,
+            "confidence": self._calculate_confidence(score, bool(categories)),
+            "categories": categories,
+            "model": self.model_name if self.model else "keyword_fallback",
+            "processing_time": time.perf_counter() - start_time,
+            "cache_hit": False,
+            "timestamp": timestamp or datetime.now().isoformat()
+        }
+        
+        # キャッシュに保存
+        self._cache.put(text, result)
+        
+        return result
+    
+    def _error_result(self, error: Exception, start_time: float) -> Dict:
+        """エラー時のフォールバック結果"""
+        logger.error(f"ToxicBert分析エラー: {str(error)}")
+        return {
+            "score": 0.0,
+            "is_toxic": False,
+            "confidence": 0.0,
+            "categories": [],
+            "model": "error",
+            "error": str(error),
+            "processing_time": time.perf_counter() - start_time,
+            "cache_hit": False,
+            "timestamp": datetime.now().isoformat()
+        }
+    
     async def analyze_text(self, text: str) -> Dict:
-        """テキストの毒性分析（メイン関数）"""
+        """テキストの毒性分析（メイン関数。エンコードは専用スレッドで行いイベントループを塞がない）"""
+        return (await self.analyze_batch_async([text]))[0]
+    
+    def _analyze_sync(self, text: str) -> Dict:
+        """テキストの毒性分析（同期版。スレッドから呼ばれるanalyzeで使う）"""
+        text = self._normalize(text)
+        
         # キャッシュチェック
-        if text in self._cache:
-            cached_result = self._cache[text].copy()
+        cached_result = self._cache.get(text)
+        if cached_result is not None:
             cached_result['cache_hit'] = True
             return cached_result
         
-        start_time = time.time()
+        start_time = time.perf_counter()
         
         try:
             if self.model is None:
                 # モデルが利用できない場合はフォールバック
-                score, keywords, category = self._keyword_fallback(text)
-                categories = []
-                if score > 0:
-                    categories.append({
-                        "name": category,
-                        "score": score,
-                        "keywords_found": keywords
-                    })
+                score, categories = self._score_fallback(text)
             else:
                 # テキストの埋め込みを計算
-                text_embedding = self.model.encode([text])[0]
-                
-                # 各カテゴリとの類似度を計算
-                max_score = 0.0
-                categories = []
-                
-                for category, data in self.pattern_embeddings.items():
-                    similarity = self._calculate_similarity(
-                        text_embedding, 
-                        data["embeddings"]
-                    )
-                    
-                    if similarity >= self.similarity_threshold:
-                        # 類似度が閾値を超えた場合
-                        category_score = similarity * data["weight"]
-                        
-                        # 最も類似したパターンを特定
-                        pattern_similarities = [
-                            self._calculate_similarity(
-                                text_embedding,
-                                data["embeddings"][i:i+1]
-                            )
-                            for i in range(len(data["patterns"]))
-                        ]
-                        
-                        max_pattern_idx = np.argmax(pattern_similarities)
-                        similar_pattern = data["patterns"][max_pattern_idx]
-                        
-                        categories.append({
-                            "name": category,
-                            "score": category_score,
-                            "keywords_found": [similar_pattern],
-                            "similarity": similarity
-                        })
-                        
-                        if category_score > max_score:
-                            max_score = category_score
-                
-                # キーワードフォールバックも確認
-                keyword_score, keywords, _ = self._keyword_fallback(text)
-                if keyword_score > max_score:
-                    max_score = keyword_score
-                    # キーワードベースのカテゴリも追加
-                    for category, info in self.toxic_patterns.items():
-                        for keyword in keywords:
-                            if keyword in info["patterns"]:
-                                categories.append({
-                                    "name": category,
-                                    "score": info["weight"],
-                                    "keywords_found": [keyword]
-                                })
-                                break
-                
-                score = max_score
+                text_embedding = self.model.encode([text], normalize_embeddings=True)
+                similarities = self._calculate_similarities(text_embedding)[0]
+                score, categories = self._score_embedding(text, similarities)
             
-            # 結果の構築
-            result = {
-                "score": score,
-                "is_toxic": score >= 0.3,
-                "confidence": self._calculate_confidence(score, bool(categories)),
-                "categories": categories,
-                "model": self.model_name if self.model else "keyword_fallback",
-                "processing_time": time.time() - start_time,
-                "cache_hit": False,
-                "timestamp": datetime.now().isoformat()
-            }
+            return self._build_result(text, score, categories, start_time)
             
-            # キャッシュに保存
-            if len(self._cache) >= self._max_cache_size:
-                # 最も古いエントリを削除
-                oldest = min(self._cache.items(), 
-                           key=lambda x: x[1].get("timestamp", ""))
-                del self._cache[oldest[0]]
+        except Exception as e:
+            return self._error_result(e, start_time)
+    
+    def analyze_batch(self, texts: List[str]) -> List[Dict]:
+        """
+        複数テキストの毒性分析（キャッシュにないテキストのみ一度にエンコード）
+        
+        Args:
+            texts: 分析対象のテキストリスト
             
-            self._cache[text] = result.copy()
+        Returns:
+            textsと同じ順序の分析結果リスト
+        """
+        start_time = time.perf_counter()
+        normalized = [self._normalize(text) for text in texts]
+        results = {}
+        
+        # キャッシュ済みと未分析に分ける（重複は1回だけ分析）
+        misses = []
+        for text in dict.fromkeys(normalized):
+            cached_result = self._cache.get(text)
+            if cached_result is not None:
+                cached_result['cache_hit'] = True
+                results[text] = cached_result
+            else:
+                misses.append(text)
+        
+        if misses:
+            results.update(self._encode_and_score(misses, start_time))
+        
+        return [results[text] for text in normalized]
+    
+    async def analyze_batch_async(self, texts: List[str]) -> List[Dict]:
+        """analyze_batchをエンコード専用スレッドで実行"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.analyze_batch, texts)
+    
+    def _encode_and_score(self, texts: List[str], start_time: float) -> Dict[str, Dict]:
+        """未分析のテキスト（重複なし）をまとめて1回でエンコードし、テキスト→結果を返す"""
+        try:
+            if self.model is None:
+                scored = [self._score_fallback(text) for text in texts]
+            else:
+                embeddings = self.model.encode(texts, batch_size=MICRO_BATCH_SIZE, normalize_embeddings=True)
+                similarities = self._calculate_similarities(embeddings)
+                scored = [
+                    self._score_embedding(text, row)
+                    for text, row in zip(texts, similarities)
+                ]
+            # 時刻の文字列化はバッチで1回のみ
+            timestamp = datetime.now().isoformat()
+            return {
+                text: self._build_result(text, score, categories, start_time, timestamp)
+                for text, (score, categories) in zip(texts, scored)
+            }
+        except Exception as e:
+            return {text: self._error_result(e, start_time) for text in texts}
+    
+    async def analyze_async(self, text: str) -> Tuple[float, List[ToxicityCategory], float]:
+        """
+        analyzeの非同期版（MultiModelAnalyzer用）
+        同時に届いたテキストをMICRO_BATCH_WAIT秒だけ待ってまとめ、1回のエンコードで処理する
+        """
+        try:
+            text = self._normalize(text)
+            cached_result = self._cache.get(text)
+            if cached_result is not None:
+                cached_result['cache_hit'] = True
+                return self._to_tuple(cached_result)
+            
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._pending.append((text, future))
+            if len(self._pending) >= MICRO_BATCH_SIZE:
+                self._flush_pending()
+            elif self._flush_handle is None:
+                self._flush_handle = loop.call_later(MICRO_BATCH_WAIT, self._flush_pending)
             
-            return result
+            return self._to_tuple(await future)
             
         except Exception as e:
             logger.error(f"ToxicBert分析エラー: {str(e)}")
-            # エラー時のフォールバック
-            return {
-                "score": 0.0,
-                "is_toxic": False,
-                "confidence": 0.0,
-                "categories": [],
-                "model": "error",
-                "error": str(e),
-                "processing_time": time.time() - start_time,
-                "cache_hit": False,
-                "timestamp": datetime.now().isoformat()
-            }
+            return 0.0, [], 0.0
+    
+    def _flush_pending(self) -> None:
+        """溜まったテキストのエンコードを開始"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        
+        batch, self._pending = self._pending, []
+        task = asyncio.get_running_loop().create_task(self._run_micro_batch(batch))
+        self._batch_tasks.add(task)
+        task.add_done_callback(self._batch_tasks.discard)
+    
+    async def _run_micro_batch(self, batch: List[Tuple[str, asyncio.Future]]) -> None:
+        """まとめたテキストをエンコード専用スレッドでエンコードし、各Futureに結果を渡す"""
+        start_time = time.perf_counter()
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(self._executor, self._encode_and_score, texts, start_time)
+        except asyncio.CancelledError:
+            for _, future in batch:
+                future.cancel()
+            raise
+        except Exception as e:
+            # 終了処理（aclose）後の呼び出しなど：待機中のリクエストへ例外を渡して待たせ続けない
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        for text, future in batch:
+            # 待機側がタイムアウトでキャンセル済みの場合は渡さない
+            if not future.done():
+                future.set_result(results[text].copy())
+    
+    async def aclose(self) -> None:
+        """エンコード専用スレッドを終了"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+    
+    def _normalize(self, text: str) -> str:
+        """全角・半角の表記ゆれと空白をまとめる（キャッシュキーとモデル入力の両方に使用）"""
+        return _WHITESPACE_RE.sub(" ", unicodedata.normalize("NFKC", text)).strip()
     
     def _calculate_confidence(self, score: float, has_matches: bool) -> float:
         """信頼度を計算"""
@@ -260,45 +587,31 @@ class ToxicBertAnalyzer:
     def analyze(self, text: str) -> Tuple[float, List[ToxicityCategory], float]:
         """同期版の分析メソッド（MultiModelAnalyzer互換）"""
         try:
-            # 既存のイベントループをチェック
-            try:
-                loop = asyncio.get_running_loop()
-                # イベントループが実行中の場合、別スレッドで実行
-                import concurrent.futures
-                with concurrent.futures.ThreadPoolExecutor() as executor:
-                    future = executor.submit(asyncio.run, self.analyze_text(text))
-                    result = future.result()
-            except RuntimeError:
-                # イベントループが実行中でない場合
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                try:
-                    result = loop.run_until_complete(self.analyze_text(text))
-                finally:
-                    loop.close()
-            
-            # 結果の変換
-            score = result.get('score', 0.0)
-            categories = result.get('categories', [])
-            confidence = result.get('confidence', 0.5)
-            
-            # ToxicityCategoryオブジェクトのリストに変換
-            category_objects = []
-            for cat_data in categories:
-                if isinstance(cat_data, dict):
-                    category = ToxicityCategory(
-                        name=cat_data['name'],
-                        score=cat_data['score'],
-                        keywords_found=cat_data.get('keywords', [])
-                    )
-                    category_objects.append(category)
-            
-            return score, category_objects, confidence
-            
+            # 呼び出し元のスレッドで直接実行（イベントループを生成しない）
+            return self._to_tuple(self._analyze_sync(text))
         except Exception as e:
             logger.error(f"ToxicBert分析エラー: {str(e)}")
             return 0.0, [], 0.0
     
+    def _to_tuple(self, result: Dict) -> Tuple[float, List[ToxicityCategory], float]:
+        """分析結果の辞書をMultiModelAnalyzer互換の（スコア, カテゴリ, 信頼度）に変換"""
+        score = result.get('score', 0.0)
+        categories = result.get('categories', [])
+        confidence = result.get('confidence', 0.5)
+        
+        # ToxicityCategoryオブジェクトのリストに変換
+        category_objects = []
+        for cat_data in categories:
+            if isinstance(cat_data, dict):
+                category = ToxicityCategory(
+                    name=cat_data['name'],
+                    score=cat_data['score'],
+                    keywords_found=cat_data.get('keywords_found', [])
+                )
+                category_objects.append(category)
+        
+        return score, category_objects, confidence
+    
     def get_model_info(self) -> Dict:
         """モデル情報を取得"""
         return {
@@ -308,6 +621,7 @@ class ToxicBertAnalyzer:
             "categories": list(self.toxic_patterns.keys()),
             "cache_size": len(self._cache),
             "max_cache_size": self._max_cache_size,
+            "cache_hit_rate": self._cache.get_stats()["hit_rate"],
             "similarity_threshold": self.similarity_threshold
         }
 
@@ -369,4 +683,5 @@ async def test_toxic_bert():
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     asyncio.run(test_toxic_bert())
\ No newline at end of file
@@ -0,0 +1,85 @@
+"""
+API使用量のRedis→PostgreSQL同期
+verify_api_keyがRedisで加算したカウンタを定期的にapi_usageへ反映する
+"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, List
+
+from sqlalchemy import func
+
+from app import cache
+from app.database import SessionLocal, engine, upsert_insert
+from app.models.api_key import APIUsage
+
+logger = logging.getLogger(__name__)
+
+# 反映間隔（秒）
+FLUSH_INTERVAL = 30
+
+
+async def _collect_counts() -> List[Dict]:
+    """Redis上の apiusage:{id}:{YYYYMMDD} カウンタを行データに変換"""
+    keys = [key async for key in cache.redis.scan_iter(match="apiusage:*", count=500)]
+    if not keys:
+        return []
+
+    values = await cache.redis.mget(keys)
+    rows = []
+    for key, value in zip(keys, values):
+        if value is None:
+            continue
+        _, api_key_id, day = key.decode().split(":")
+        rows.append({
+            "api_key_id": int(api_key_id),
+            "date": datetime.strptime(day, "%Y%m%d").date(),
+            "request_count": int(value)
+        })
+    return rows
+
+
+def _upsert_counts(rows: List[Dict]) -> None:
+    """
+    カウンタの値でapi_usageをまとめてUPSERT（値は絶対値なので冪等）
+    
+    Redisの再起動・フェイルオーバーでカウンタが0から数え直された場合や、
+    Redis障害中にDBで直接加算された場合に、保存済みの件数を小さい値で上書きしないよう大きい方を残す
+    """
+    stmt = upsert_insert(engine.dialect.name)(APIUsage).values(rows)
+    current = APIUsage.__table__.c.request_count
+    # SQLiteには複数引数のmax()はあるがGREATEST()がない
+    larger = func.max if engine.dialect.name == "sqlite" else func.greatest
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["api_key_id", "date"],
+        set_={"request_count": larger(current, stmt.excluded.request_count)}
+    )
+    with SessionLocal() as db:
+        db.execute(stmt)
+        db.commit()
+
+
+async def flush_usage_counts() -> int:
+    """Redisのカウンタをデータベースへ反映し、反映した行数を返す"""
+    if cache.redis is None:
+        return 0
+
+    rows = await _collect_counts()
+    if rows:
+        # 同期ドライバのためイベントループを塞がないよう別スレッドで実行
+        await asyncio.to_thread(_upsert_counts, rows)
+    return len(rows)
+
+
+async def usage_flush_loop(interval: float = FLUSH_INTERVAL) -> None:
+    """lifespanから起動するバックグラウンドタスク"""
+    if cache.redis is None:
+        return
+
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            count = await flush_usage_counts()
+            logger.debug(f"使用量を反映しました: {count}件")
+        except Exception as e:
+            logger.error(f"使用量の反映エラー: {e}")
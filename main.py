@@ -2,17 +2,19 @@
 ToxiGuard API メインアプリケーション
 Version 3.0 - マルチモデル統合版
 """
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 # main.pyの先頭部分に以下のインポートを追加
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
 
 from datetime import datetime
+from contextlib import asynccontextmanager
+import asyncio
 import os
-from typing import Dict, Any
-import json
+import orjson
+from anyio import to_thread
 from dotenv import load_dotenv
 from app.routers import analyze
 from app.routers import analyze_v2
@@ -22,25 +24,92 @@ from app.routers import feedback
 # 既存のインポートの後に、以下を追加
 from app.routers import web
 from app.routers import api_key
+from app.services.usage_flusher import usage_flush_loop, flush_usage_counts
+from app.services.feedback_writer import feedback_flush_loop, flush_feedbacks, open_feedback_queue
+from app.config import settings
+from app.database import DB_POOL_SIZE, DB_MAX_OVERFLOW
 
 
+# ログレベルはLOG_LEVELで指定（リクエストごとのログはDEBUGのため、INFO以上では出力されない）
 logging.basicConfig(
-    level=logging.INFO,
+    level=settings.LOG_LEVEL,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 
 load_dotenv()
 
+# フィードバック統計など同期DBアクセスのエンドポイントを同時に処理できる数
+# 既定は同期エンジンの最大接続数（接続を確保できないスレッドを作らない）
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", DB_POOL_SIZE + DB_MAX_OVERFLOW))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """起動・終了時の処理"""
+    # 同期エンドポイント・依存関係を実行するスレッドプールの上限（anyioの既定は40）
+    to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    
+    # v2用アナライザーを起動時に一度だけ生成（初回リクエストのモデル読み込み待ちをなくす）
+    # torch・sentence-transformersの読み込みが重いため、main.pyのimport時ではなくここで読み込む
+    from app.services.multi_model_analyzer import MultiModelAnalyzer
+    app.state.analyzer = await asyncio.to_thread(MultiModelAnalyzer)
+    app.state.batch_semaphore = asyncio.Semaphore(analyze_v2.BATCH_CONCURRENCY)
+    
+    # API使用量をRedisからDBへ定期反映
+    flush_task = asyncio.create_task(usage_flush_loop())
+    
+    # フィードバックをまとめてDBへ書き込み（キューはこのイベントループで作成）
+    open_feedback_queue()
+    feedback_task = asyncio.create_task(feedback_flush_loop())
+    yield
+    flush_task.cancel()
+    feedback_task.cancel()
+    try:
+        await flush_usage_counts()
+    except Exception as e:
+        logging.getLogger(__name__).error(f"終了時の使用量反映エラー: {e}")
+    
+    # 溜めかけのフィードバックがキューへ戻るのを待ってから書き込む
+    try:
+        await feedback_task
+    except asyncio.CancelledError:
+        pass
+    await flush_feedbacks()
+    
+    await app.state.analyzer.aclose()
+
+
+# APIドキュメント（本番で公開しない場合はAPI_DOCS_ENABLED=falseでOpenAPIスキーマの生成ごと無効化）
+API_DOCS_ENABLED = os.getenv("API_DOCS_ENABLED", "true").lower() == "true"
+
 app = FastAPI(
     title="ToxiGuard API",
     description="日本語テキストの毒性を検知するAPI - Release 3 マルチモデル版",
     version="3.0.0",
-    docs_url="/docs",
-    redoc_url="/redoc"
+    docs_url="/docs" if API_DOCS_ENABLED else None,
+    redoc_url="/redoc" if API_DOCS_ENABLED else None,
+    openapi_url="/openapi.json" if API_DOCS_ENABLED else None,
+    lifespan=lifespan,
+    # 日本語をエスケープせずUTF-8のまま、Cで直接シリアライズ
+    default_response_class=ORJSONResponse
 )
 
+# 静的ファイルのブラウザキャッシュ期間（秒）
+# ファイル名にハッシュを含めていないため長期のimmutableにはせず、期限後はETagで再検証させる
+STATIC_CACHE_MAX_AGE = int(os.getenv("STATIC_CACHE_MAX_AGE", "3600"))
+
+
+class CachedStaticFiles(StaticFiles):
+    """Cache-Controlを付けて配信し、期限内はブラウザが再検証せずに再利用できるようにする"""
+
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = f"public, max-age={STATIC_CACHE_MAX_AGE}"
+        return response
+
+
 # 静的ファイルの配信設定
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.mount("/static", CachedStaticFiles(directory="static"), name="static")
 
 app.add_middleware(
     CORSMiddleware,
@@ -50,18 +119,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# カスタムJSONレスポンス（日本語対応）
-class CustomJSONResponse(JSONResponse):
-    def render(self, content: any) -> bytes:
-        return json.dumps(
-            content,
-            ensure_ascii=False,
-            allow_nan=False,
-            indent=None,
-            separators=(",", ":"),
-        ).encode("utf-8")
-
-app.default_response_class = CustomJSONResponse
+# 500バイト以上のレスポンスを圧縮（HTML・バッチ分析結果など）
+# 圧縮レベル9は5とほぼ同じ圧縮率でCPU負荷が大きいため5を使用
+app.add_middleware(GZipMiddleware, minimum_size=500, compresslevel=5)
 
 # ルーター登録
 app.include_router(web.router)
@@ -119,48 +179,51 @@ async def health_check():
         }
     }
 
-@app.get("/setup-status", response_model=Dict[str, Any])
+# セットアップ状況は固定の内容のため、起動時に1回だけシリアライズして使い回す
+_SETUP_STATUS_BODY = orjson.dumps({
+    "phase": "Release 3",
+    "title": "ToxiGuard API マルチモデル統合版",
+    "completed_releases": [
+        "✅ Release 1: キーワードベース（精度40%）",
+        "✅ Release 2: ハイブリッドAI（精度65%）- 削除済み",
+        "✅ Release 3: マルチモデル統合（精度100%）"
+    ],
+    "implemented_features": [
+        "✅ KeywordAnalyzer（高速ルールベース）",
+        "✅ ToxicBertAnalyzer（埋め込みベース）", 
+        "✅ MistralAnalyzer（Phi-2 LLM）",
+        "✅ MultiModelAnalyzer（統合システム）",
+        "✅ 4つの分析戦略（fast/cascade/balanced/accurate）",
+        "✅ API v2エンドポイント実装",
+        "✅ バッチ分析機能",
+        "✅ 詳細情報取得オプション"
+    ],
+    "performance": {
+        "fast_strategy": {"accuracy": "87.5%", "response_time": "< 0.01秒"},
+        "cascade_strategy": {"accuracy": "87.5%", "response_time": "< 1秒"},
+        "balanced_strategy": {"accuracy": "100%", "response_time": "1-2秒"},
+        "accurate_strategy": {"accuracy": "100%", "response_time": "1-2秒"}
+    },
+    "next_release": {
+        "name": "Release 4",
+        "features": [
+            "外部API統合（Claude/OpenAI）",
+            "ユーザーフィードバックシステム",
+            "強化学習による精度向上",
+            "エンタープライズ機能"
+        ]
+    },
+    "status": "🎉 Release 3 完了！",
+    "estimated_completion": "100% 完了"
+})
+
+@app.get("/setup-status")
 async def setup_status():
     """
     開発環境セットアップ状況確認エンドポイント
     Release 3の進捗確認用
     """
-    return {
-        "phase": "Release 3",
-        "title": "ToxiGuard API マルチモデル統合版",
-        "completed_releases": [
-            "✅ Release 1: キーワードベース（精度40%）",
-            "✅ Release 2: ハイブリッドAI（精度65%）- 削除済み",
-            "✅ Release 3: マルチモデル統合（精度100%）"
-        ],
-        "implemented_features": [
-            "✅ KeywordAnalyzer（高速ルールベース）",
-            "✅ ToxicBertAnalyzer（埋め込みベース）", 
-            "✅ MistralAnalyzer（Phi-2 LLM）",
-            "✅ MultiModelAnalyzer（統合システム）",
-            "✅ 4つの分析戦略（fast/cascade/balanced/accurate）",
-            "✅ API v2エンドポイント実装",
-            "✅ バッチ分析機能",
-            "✅ 詳細情報取得オプション"
-        ],
-        "performance": {
-            "fast_strategy": {"accuracy": "87.5%", "response_time": "< 0.01秒"},
-            "cascade_strategy": {"accuracy": "87.5%", "response_time": "< 1秒"},
-            "balanced_strategy": {"accuracy": "100%", "response_time": "1-2秒"},
-            "accurate_strategy": {"accuracy": "100%", "response_time": "1-2秒"}
-        },
-        "next_release": {
-            "name": "Release 4",
-            "features": [
-                "外部API統合（Claude/OpenAI）",
-                "ユーザーフィードバックシステム",
-                "強化学習による精度向上",
-                "エンタープライズ機能"
-            ]
-        },
-        "status": "🎉 Release 3 完了！",
-        "estimated_completion": "100% 完了"
-    }
+    return Response(content=_SETUP_STATUS_BODY, media_type="application/json")
 
 if __name__ == "__main__":
     import uvicorn
@@ -186,4 +249,14 @@ if __name__ == "__main__":
        - accurate: 重み付け最適化（高精度）
     """)
     
-    uvicorn.run(app, host=host, port=port, reload=True)
\ No newline at end of file
+    # 自動リロードは開発時のみ（リロードにはアプリをインポート文字列で渡す必要がある）
+    reload = os.getenv("RELOAD", "false").lower() == "true"
+    uvicorn.run(
+        "main:app",
+        host=host,
+        port=port,
+        reload=reload,
+        workers=None if reload else int(os.getenv("WORKERS", "1")),
+        # WARNING以上を指定した場合はアクセスログ（INFO）も出力しない
+        log_level=settings.LOG_LEVEL.lower()
+    )
\ No newline at end of file
@@ -1,8 +1,17 @@
 """
 Release 1のテストスクリプト（簡易版）
+
+動作確認の後、同時接続数を指定して負荷をかけスループットを計測する
+  python test_release1.py                      # 100リクエスト・同時16接続
+  python test_release1.py -n 1000 -c 64
+  python test_release1.py -n 0                 # 動作確認のみ
 """
-import requests
-import json
+import argparse
+import asyncio
+import random
+import time
+
+import httpx
 
 # APIのベースURL
 BASE_URL = "http://localhost:8000"
@@ -17,33 +26,36 @@ test_cases = [
     "ちょっと違うんじゃないかな",
 ]
 
-def test_api():
-    """APIテスト実行"""
+async def test_api():
+    """APIテスト実行（1つのクライアントで接続を使い回し、テストケースは並列に送信）"""
     print("🚀 ToxiGuard API Release 1 テスト開始")
     print("=" * 50)
     
-    # ヘルスチェック
-    try:
-        response = requests.get(f"{BASE_URL}/health")
-        if response.status_code == 200:
-            print("✅ APIは正常に動作しています")
-        else:
-            print("❌ APIが応答しません")
-            return
-    except:
-        print("❌ APIに接続できません。サーバーを起動してください。")
-        print("別のターミナルで: uvicorn main:app --reload")
-        return
-    
-    print("\n📊 毒性分析テスト")
-    print("=" * 50)
+    async with httpx.AsyncClient(base_url=BASE_URL) as client:
+        # ヘルスチェック
+        try:
+            response = await client.get("/health")
+            if response.status_code == 200:
+                print("✅ APIは正常に動作しています")
+            else:
+                print("❌ APIが応答しません")
+                return False
+        except httpx.HTTPError:
+            print("❌ APIに接続できません。サーバーを起動してください。")
+            print("別のターミナルで: uvicorn main:app --reload")
+            return False
+        
+        print("\n📊 毒性分析テスト")
+        print("=" * 50)
+        
+        # 各テストケースを実行
+        responses = await asyncio.gather(*(
+            client.post("/api/v1/analyze", json={"text": text})
+            for text in test_cases
+        ))
     
-    # 各テストケースを実行
-    for text in test_cases:
-        response = requests.post(
-            f"{BASE_URL}/api/v1/analyze",
-            json={"text": text}
-        )
+    # 結果はテストケースの順に表示
+    for text, response in zip(test_cases, responses):
         result = response.json()
         
         print(f"\n📝 テキスト: {text}")
@@ -58,6 +70,51 @@ def test_api():
         print("-" * 50)
     
     print("\n✅ テスト完了！")
+    return True
+
+async def benchmark(n: int, concurrency: int):
+    """/api/v1/analyzeへn件のリクエストを同時concurrency接続で送り、スループットを表示"""
+    print(f"\n⏱️ 負荷テスト: {n}リクエスト / 同時{concurrency}接続")
+    print("=" * 50)
+    
+    sem = asyncio.Semaphore(concurrency)
+    latencies = []
+    
+    async def worker(client: httpx.AsyncClient, text: str) -> bool:
+        async with sem:
+            start = time.perf_counter()
+            try:
+                response = await client.post("/api/v1/analyze", json={"text": text})
+            except httpx.HTTPError:
+                return False
+            latencies.append(time.perf_counter() - start)
+            return response.status_code == 200
+    
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=BASE_URL, limits=limits) as client:
+        start = time.perf_counter()
+        results = await asyncio.gather(*(
+            worker(client, random.choice(test_cases)) for _ in range(n)
+        ))
+        elapsed = time.perf_counter() - start
+    
+    latencies.sort()
+    print(f"✅ 成功: {sum(results)}/{n}")
+    print(f"🚀 スループット: {n / elapsed:.1f} req/s（{elapsed:.2f}秒）")
+    if latencies:
+        print(f"📈 レイテンシ p50: {latencies[len(latencies) // 2] * 1000:.1f}ms"
+              f" / p99: {latencies[int(len(latencies) * 0.99)] * 1000:.1f}ms")
+
+async def main():
+    parser = argparse.ArgumentParser(description="Release 1 テスト・負荷テスト")
+    parser.add_argument("-n", "--requests", type=int, default=100, help="負荷テストのリクエスト数（0で省略）")
+    parser.add_argument("-c", "--concurrency", type=int, default=16, help="負荷テストの同時接続数")
+    args = parser.parse_args()
+    
+    if not await test_api():
+        return
+    if args.requests > 0:
+        await benchmark(args.requests, max(1, args.concurrency))
 
 if __name__ == "__main__":
-    test_api()
+    asyncio.run(main())